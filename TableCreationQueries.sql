@@ -5,6 +5,9 @@ DROP TABLE IF EXISTS Fighter_stats_per_fight CASCADE;
 DROP TABLE IF EXISTS Betting_odds CASCADE;
 DROP TABLE IF EXISTS Fighter_rankings CASCADE;
 DROP TABLE IF EXISTS Fight_differentials CASCADE;
+DROP TABLE IF EXISTS Etl_watermarks CASCADE;
+DROP TABLE IF EXISTS Fighter_ratings CASCADE;
+DROP TABLE IF EXISTS Fighter_aliases CASCADE;
 
 DROP TYPE IF EXISTS fighterStances;
 DROP TYPE IF EXISTS weight_classes;
@@ -34,6 +37,24 @@ CREATE TABLE Fighters(
   PRIMARY KEY (fighter_id)
 );
 
+-- Every spelling of a fighter's name found in the sources, resolved to one fighter by resolve.py.
+-- The fighter_name of a fighter is one of its aliases. Only spellings with the same words are merged; a fuzzy
+-- match keeps its own fighter and names the fighter it may be in candidate_fighter_id, for review.
+CREATE TABLE Fighter_aliases(
+  alias_id SERIAL,
+  alias_name VARCHAR(100) NOT NULL UNIQUE,
+  fighter_id INT NOT NULL,
+  match_score DECIMAL(4,3), -- Similarity of the spelling to the one it was matched to, 1 for the same name
+  candidate_fighter_id INT, -- Fighter the spelling may be, not merged until reviewed
+  candidate_score DECIMAL(4,3), -- Similarity of the spelling to the candidate
+
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+
+  PRIMARY KEY (alias_id),
+  FOREIGN KEY (fighter_id) REFERENCES Fighters(fighter_id) ON DELETE CASCADE,
+  FOREIGN KEY (candidate_fighter_id) REFERENCES Fighters(fighter_id) ON DELETE SET NULL
+);
+
 -- Events & Locations
 CREATE TABLE Events(
   event_id SERIAL,
@@ -205,4 +226,33 @@ CREATE TABLE Fight_differentials(
   
   PRIMARY KEY (differential_id),
   FOREIGN KEY (fight_id) REFERENCES Fights(fight_id) ON DELETE CASCADE
-);
\ No newline at end of file
+);
+
+-- Last event loaded by the ETL, so incremental runs only process newer fights
+CREATE TABLE Etl_watermarks(
+  watermark_id SERIAL,
+  last_event_date DATE NOT NULL,
+  last_event_hash CHAR(64) NOT NULL, -- Hash of the fights loaded on last_event_date
+  fights_loaded INT NOT NULL,
+
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+
+  PRIMARY KEY (watermark_id)
+);
+
+-- Glicko rating of each fighter before and after every fight, computed in date order by ratings.py.
+-- Kept at full precision so an incremental run continues exactly where the last one stopped.
+CREATE TABLE Fighter_ratings(
+  fight_id INT NOT NULL,
+  fighter_id INT NOT NULL,
+  rating_before DOUBLE PRECISION NOT NULL,
+  deviation_before DOUBLE PRECISION NOT NULL,
+  rating_after DOUBLE PRECISION NOT NULL,
+  deviation_after DOUBLE PRECISION NOT NULL,
+
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+
+  PRIMARY KEY (fight_id, fighter_id),
+  FOREIGN KEY (fight_id) REFERENCES Fights(fight_id) ON DELETE CASCADE,
+  FOREIGN KEY (fighter_id) REFERENCES Fighters(fighter_id) ON DELETE CASCADE
+);
@@ -0,0 +1,199 @@
+# Backtests staking strategies on the moneylines of Betting_odds against the results in Fights. The winner model
+# of predict.py, retrained walk-forward so that no fight is priced with a model that saw it, gives the probabilities
+# the strategies bet on. Every strategy is computed for all fights at once with NumPy, and grids of strategy
+# parameters are swept over a process pool.
+
+import argparse
+import itertools
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+
+from ETL import build_tables_cached
+from predict import L2_PENALTY, read_tables, training_data, out_of_sample_probabilities
+
+# Starting bankroll of every strategy in units of one flat stake, so profits and bankrolls compare across strategies.
+# Flat strategies stake one unit a bet, Kelly stakes fractions of the bankroll.
+BANKROLL = 100.0
+
+# Parameters of every strategy and the values a sweep tries by default
+STRATEGY_GRIDS = {
+    # One unit on the model's pick when its probability is at least min_probability
+    'flat': {'min_probability': np.linspace(0.5, 0.8, 61)},
+    # `fraction` of the Kelly stake on the side with the larger edge, when that edge is at least min_edge
+    'kelly': {'fraction': np.linspace(0.02, 1.0, 50), 'min_edge': np.linspace(0.0, 0.19, 20)},
+    # One unit on the side whose expected return per unit is above threshold
+    'ev_threshold': {'threshold': np.linspace(0.0, 0.5, 101)},
+    # One unit on the underdog when its moneyline is at least min_odds and the model gives it min_probability
+    'underdog': {'min_odds': np.arange(100, 600, 25), 'min_probability': np.linspace(0.0, 0.5, 51)}
+}
+
+DEFAULT_PARAMETERS = {
+    'flat': {'min_probability': 0.5},
+    'kelly': {'fraction': 0.25, 'min_edge': 0.0},
+    'ev_threshold': {'threshold': 0.05},
+    'underdog': {'min_odds': 100, 'min_probability': 0.4}
+}
+
+# Arrays of the fights that have both moneylines and an out-of-sample probability, in date order. The decimal
+# odds come from the expected values, which are the profit of a 100 stake when that side wins.
+def backtest_data(tables, start='2015-01-01', step_months=12, l2=L2_PENALTY):
+    features, labels, dates, fight_ids = training_data(tables)
+    probability = out_of_sample_probabilities(features, labels, dates, start, step_months, l2)
+
+    odds = dict(tables)['betting_odds'].set_index('fight_id').reindex(fight_ids)
+    keep = ~np.isnan(probability) & odds['red_expected_value'].notna().to_numpy() \
+        & odds['blue_expected_value'].notna().to_numpy()
+    odds = odds[keep]
+
+    dates = dates[keep]
+    return {
+        'fight_id': fight_ids[keep],
+        'red_probability': probability[keep],
+        'red_won': labels[keep] == 1,
+        'red_odds': odds['red_odds'].to_numpy(dtype='float64'),
+        'blue_odds': odds['blue_odds'].to_numpy(dtype='float64'),
+        'red_decimal': 1 + odds['red_expected_value'].to_numpy(dtype='float64') / 100,
+        'blue_decimal': 1 + odds['blue_expected_value'].to_numpy(dtype='float64') / 100,
+        'date': dates,
+        # Position of the first fight of every date: the fights of a date are bet together from the same bankroll
+        'date_starts': np.flatnonzero(np.r_[True, dates[1:] != dates[:-1]])
+    }
+
+# Side (True for red) and stake of every fight under a strategy. A stake of 0 means no bet. Flat strategies stake
+# units, Kelly stakes fractions of the bankroll.
+def strategy_stakes(data, strategy, parameters):
+    red_probability, red_decimal, blue_decimal = data['red_probability'], data['red_decimal'], data['blue_decimal']
+    red_edge = red_probability * red_decimal - 1
+    blue_edge = (1 - red_probability) * blue_decimal - 1
+
+    if strategy == 'flat':
+        bet_red = red_probability >= 0.5
+        stake = np.maximum(red_probability, 1 - red_probability) >= parameters['min_probability']
+    elif strategy == 'kelly':
+        bet_red = red_edge >= blue_edge
+        edge = np.where(bet_red, red_edge, blue_edge)
+        kelly = edge / (np.where(bet_red, red_decimal, blue_decimal) - 1)
+        stake = np.where((edge > 0) & (edge >= parameters['min_edge']), parameters['fraction'] * kelly, 0)
+    elif strategy == 'ev_threshold':
+        bet_red = red_edge >= blue_edge
+        stake = np.where(bet_red, red_edge, blue_edge) > parameters['threshold']
+    elif strategy == 'underdog':
+        bet_red = data['red_odds'] > data['blue_odds']
+        underdog_odds = np.where(bet_red, data['red_odds'], data['blue_odds'])
+        underdog_probability = np.where(bet_red, red_probability, 1 - red_probability)
+        stake = (underdog_odds >= parameters['min_odds']) & (underdog_probability >= parameters['min_probability'])
+    else:
+        raise ValueError(f"Unknown strategy {strategy}, expected one of {', '.join(STRATEGY_GRIDS)}")
+
+    return bet_red, np.asarray(stake, dtype='float64')
+
+# Bets every fight of `data` with a strategy and returns its ROI, hit rate and maximum drawdown. Every strategy
+# starts from BANKROLL units, and the staked amount, profit and final bankroll are in those units. The bankroll is
+# settled once per date, flat stakes adding their profits and Kelly stakes compounding. A flat drawdown of 1 or more
+# means the flat bankroll was lost.
+def run_strategy(data, strategy, parameters):
+    bet_red, stake = strategy_stakes(data, strategy, parameters)
+    won = bet_red == data['red_won']
+    returns = np.where(won, np.where(bet_red, data['red_decimal'], data['blue_decimal']) - 1, -1.0)
+    date_starts = data['date_starts']
+
+    if strategy == 'kelly':
+        # The Kelly stakes of a busy date can add up to more than the bankroll, then they are scaled down to it
+        date_stakes = np.add.reduceat(stake, date_starts)
+        stake = stake / np.repeat(np.maximum(date_stakes, 1), np.diff(np.r_[date_starts, len(stake)]))
+        growth = 1 + np.add.reduceat(stake * returns, date_starts)
+        bankroll = BANKROLL * np.cumprod(np.r_[1.0, growth])
+        staked = float((bankroll[:-1] * np.add.reduceat(stake, date_starts)).sum())
+    else:
+        bankroll = BANKROLL + np.r_[0.0, np.cumsum(np.add.reduceat(stake * returns, date_starts))]
+        staked = float(stake.sum())
+
+    bets = stake > 0
+    peak = np.maximum.accumulate(bankroll)
+    return {
+        'strategy': strategy,
+        **{name: float(value) for name, value in parameters.items()},
+        'bets': int(bets.sum()),
+        'hit_rate': float(won[bets].mean()) if bets.any() else np.nan,
+        'staked': staked,
+        'profit': float(bankroll[-1] - bankroll[0]),
+        'roi': float((bankroll[-1] - bankroll[0]) / staked) if staked > 0 else np.nan,
+        'max_drawdown': float(((peak - bankroll) / peak).max()),
+        'final_bankroll': float(bankroll[-1])
+    }
+
+# (strategy, parameters) of every combination of the grid values of each strategy
+def parameter_grid(strategies=None, grids=STRATEGY_GRIDS):
+    configurations = []
+    for strategy in strategies or grids:
+        names = list(grids[strategy])
+        for values in itertools.product(*grids[strategy].values()):
+            configurations.append((strategy, dict(zip(names, values))))
+    return configurations
+
+# The worker processes receive the arrays once, when they start, rather than with every configuration
+worker_data = None
+
+def init_worker(data):
+    global worker_data
+    worker_data = data
+
+def run_configurations(configurations):
+    return [run_strategy(worker_data, strategy, parameters) for strategy, parameters in configurations]
+
+# Runs every configuration over `workers` processes, in batches so that each task is worth shipping to a worker.
+# The results come back in the order of the configurations.
+def sweep(data, configurations, workers=1, batch_size=256):
+    batches = [configurations[i:i + batch_size] for i in range(0, len(configurations), batch_size)]
+    if workers <= 1:
+        init_worker(data)
+        results = [run_configurations(batch) for batch in batches]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(data,)) as executor:
+            results = list(executor.map(run_configurations, batches))
+    return pd.DataFrame([result for batch in results for result in batch])
+
+def main():
+    parser = argparse.ArgumentParser(description='Backtest staking strategies on the moneylines in Betting_odds')
+    parser.add_argument('--csv', default='ufc-master.csv', help='Master CSV whose (cached) tables are backtested')
+    parser.add_argument('--database-url', help='Backtest the loaded tables of this database instead of --csv')
+    parser.add_argument('--start', default='2015-01-01', help='First date the walk-forward model bets on')
+    parser.add_argument('--step-months', type=int, default=12, help='How often the walk-forward model is retrained')
+    parser.add_argument('--strategy', nargs='+', choices=list(STRATEGY_GRIDS), help='Only run these strategies')
+    parser.add_argument('--sweep', action='store_true', help='Run the parameter grid of every strategy')
+    parser.add_argument('--workers', type=int, default=4, help='Processes running the parameter grid')
+    parser.add_argument('--top', type=int, default=5, help='Best configurations by ROI shown per strategy')
+    parser.add_argument('--output', help='Also write every result to this CSV file')
+    args = parser.parse_args()
+
+    if args.database_url:
+        tables = read_tables(create_engine(args.database_url), ['fights', 'events', 'fight_differentials', 'betting_odds'])
+    else:
+        tables = build_tables_cached(args.csv)[0]
+    data = backtest_data(tables, args.start, args.step_months)
+    print(f"Backtesting {len(data['fight_id'])} fights from {pd.Timestamp(data['date'][0]).date()} "
+          f"to {pd.Timestamp(data['date'][-1]).date()}")
+
+    strategies = args.strategy or list(STRATEGY_GRIDS)
+    pd.set_option('display.width', 200)
+    if args.sweep:
+        configurations = parameter_grid(strategies)
+        start = time.perf_counter()
+        results = sweep(data, configurations, args.workers)
+        seconds = time.perf_counter() - start
+        for strategy, group in results.groupby('strategy', sort=False):
+            print(group.dropna(axis=1, how='all').nlargest(args.top, 'roi').to_string(index=False))
+        print(f"Ran {len(results)} configurations in {seconds:.2f}s with {args.workers} workers")
+    else:
+        results = pd.DataFrame([run_strategy(data, strategy, DEFAULT_PARAMETERS[strategy]) for strategy in strategies])
+        print(results.to_string(index=False))
+
+    if args.output:
+        results.to_csv(args.output, index=False)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,369 @@
+# Benchmarks for the ETL transforms on synthetic master files built by replicating ufc-master.csv, and a suite that
+# times the whole pipeline on master files generated by synthetic.py
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+from history import FighterHistory
+from ratings import RatingState, rate_fights, fights_from_tables
+from backtest import backtest_data, run_strategy, parameter_grid, sweep, DEFAULT_PARAMETERS
+from resolve import FighterNameIndex, known_aliases, name_keys, similarity
+from instrument import RunReport, compare_reports, watch_engine, max_rss_mb
+from synthetic import write_synthetic_master
+from incremental import PRIMARY_KEYS
+from ETL import (unpivot_corners, attach_fighter_ids, create_fighter_table, create_fighter_rankings, clean_fighter_names,
+                 time_parser, canonical_fighter_names, name_cache, parse_round_times, read_master, build_tables,
+                 run_full_load, watermark_of)
+
+# Repeats the rows of the master frame until it has the requested number of rows
+def replicate_master(df, rows):
+    return df.iloc[np.resize(np.arange(len(df)), rows)].reset_index(drop=True)
+
+# Best wall time of a few calls, to keep one-off allocator or cache noise out of the numbers
+def time_call(func, *args, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+# Unpivots the corners and builds the rankings table, the full cost of producing Fighter_rankings from a master frame
+def build_rankings(df, fighters):
+    corners = attach_fighter_ids(unpivot_corners(df), fighters)
+    return create_fighter_rankings(corners)
+
+def bench_rankings(master, sizes):
+    sizes = sizes or [10000, 100000, 1000000]
+    fighters = create_fighter_table(unpivot_corners(master))
+
+    print(f"{'rows':>10} {'seconds':>10} {'us/row':>10}")
+    for rows in sizes:
+        df = replicate_master(master, rows)
+        seconds = time_call(build_rankings, df, fighters)
+        print(f"{rows:>10} {seconds:>10.3f} {seconds / rows * 1e6:>10.3f}")
+
+# Name cleaning with an empty cache, as at the start of a run
+def clean_names_cold(names):
+    with name_cache():
+        return canonical_fighter_names(names)
+
+# Scalar helpers applied row by row against their column versions, on the real file and a 100x replica by default
+def bench_cleaning(master, sizes):
+    sizes = sizes or [len(master), len(master) * 100]
+
+    print(f"{'rows':>10} {'kernel':>12} {'apply s':>10} {'vector s':>10} {'speedup':>8}")
+    for rows in sizes:
+        df = replicate_master(master, rows)
+        names = pd.concat([df['RedFighter'], df['BlueFighter']], ignore_index=True)
+
+        kernels = [
+            ('names', lambda: names.apply(clean_fighter_names), lambda: clean_names_cold(names)),
+            ('round_time', lambda: df['FinishRoundTime'].apply(time_parser),
+             lambda: parse_round_times(df['FinishRoundTime']))
+        ]
+        for kernel, scalar, vectorized in kernels:
+            scalar_seconds = time_call(scalar)
+            vector_seconds = time_call(vectorized)
+            print(f"{rows:>10} {kernel:>12} {scalar_seconds:>10.3f} {vector_seconds:>10.3f} "
+                  f"{scalar_seconds / vector_seconds:>7.1f}x")
+
+# The dtypes a frame had before the compact dtype plan: strings and categoricals as object, integers as int64
+# (Int64 where there are missing values) and floats as float64
+def widen(df):
+    wide = {}
+    for column in df:
+        values = df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            wide[column] = values.astype('object')
+        elif pd.api.types.is_integer_dtype(values.dtype):
+            wide[column] = values.astype('Int64' if values.hasnans else 'int64')
+        elif pd.api.types.is_float_dtype(values.dtype):
+            wide[column] = values.astype('float64')
+        else:
+            wide[column] = values
+    return pd.DataFrame(wide)
+
+def memory_mb(df):
+    return df.memory_usage(deep=True).sum() / 1e6
+
+# Deep memory of the master frame and every loaded table with the compact dtypes against the widened ones
+def bench_memory(master, sizes):
+    sizes = sizes or [len(master)]
+
+    print(f"{'rows':>10} {'table':>24} {'wide MB':>10} {'compact MB':>11} {'saved':>7}")
+    for rows in sizes:
+        df = replicate_master(master, rows)
+        for table_name, table in [('master', df)] + build_tables(df):
+            wide_mb, compact_mb = memory_mb(widen(table)), memory_mb(table)
+            print(f"{rows:>10} {table_name:>24} {wide_mb:>10.1f} {compact_mb:>11.1f} {1 - compact_mb / wide_mb:>6.0%}")
+
+# Serial table build against the process-pool build of the fact tables, checking both give the same tables
+def bench_transform(master, sizes, workers=(2, 4)):
+    sizes = sizes or [len(master), 1000000]
+
+    print(f"{'rows':>10} {'workers':>8} {'seconds':>10} {'speedup':>8}")
+    for rows in sizes:
+        df = replicate_master(master, rows)
+        serial_tables = build_tables(df)
+        serial_seconds = time_call(build_tables, df, repeat=1)
+        print(f"{rows:>10} {1:>8} {serial_seconds:>10.3f} {1:>7.1f}x")
+
+        for worker_count in workers:
+            start = time.perf_counter()
+            parallel_tables = build_tables(df, worker_count)
+            seconds = time.perf_counter() - start
+            for (table_name, serial), (_, parallel) in zip(serial_tables, parallel_tables):
+                pd.testing.assert_frame_equal(serial, parallel, obj=table_name)
+            print(f"{rows:>10} {worker_count:>8} {seconds:>10.3f} {serial_seconds / seconds:>7.1f}x")
+
+# Point-in-time lookups against the history index: one at a time, batched, and whole cards of 13 fights
+def bench_history(master, sizes, queries=100000):
+    sizes = sizes or [len(master), 100000]
+    rng = np.random.default_rng(0)
+
+    print(f"{'rows':>10} {'build s':>8} {'scalar/s':>10} {'batch/s':>11} {'card ms':>8}")
+    for rows in sizes:
+        df = replicate_master(master, rows)
+        start = time.perf_counter()
+        history = FighterHistory(build_tables(df))
+        build_seconds = time.perf_counter() - start
+
+        fighter_ids = rng.choice(history.fighter_ids, queries)
+        dates = pd.to_datetime(rng.choice(df['Date'].unique(), queries))
+
+        scalar_seconds = time_call(lambda: [history.position(f, d) for f, d in zip(fighter_ids[:5000], dates[:5000])])
+        batch_seconds = time_call(history.as_of_batch, fighter_ids, dates)
+        card = pd.DataFrame({'red_fighter_id': fighter_ids[:13], 'blue_fighter_id': fighter_ids[13:26],
+                             'event_date': dates[:13]})
+        card_seconds = time_call(history.lookup_card, card)
+        print(f"{rows:>10} {build_seconds:>8.2f} {5000 / scalar_seconds:>10.0f} {queries / batch_seconds:>11.0f} "
+              f"{card_seconds * 1000:>8.2f}")
+
+# Full replay of the rating history from an empty state, then the incremental update of the latest card alone
+def bench_ratings(master, sizes):
+    sizes = sizes or [len(master), 100000]
+
+    print(f"{'rows':>10} {'replay s':>9} {'fights/s':>10} {'last card ms':>13}")
+    for rows in sizes:
+        fights = fights_from_tables(build_tables(replicate_master(master, rows)))
+        replay_seconds = time_call(lambda: rate_fights(fights, RatingState()))
+
+        last_card = fights['event_date'] == fights['event_date'].max()
+        state = RatingState()
+        rate_fights(fights[~last_card], state)
+        card_seconds = time_call(lambda: rate_fights(fights[last_card], state), repeat=1)
+        print(f"{rows:>10} {replay_seconds:>9.3f} {rows / replay_seconds:>10.0f} {card_seconds * 1000:>13.2f}")
+
+# Time to bet every fight with each strategy, and configurations swept per second serially and over four processes
+def bench_backtest(master, sizes):
+    sizes = sizes or [len(master), 100000]
+    configurations = parameter_grid()
+
+    print(f"{'rows':>10} {'fights':>8} {'strategy ms':>12} {'sweep cfg/s':>12} {'4 workers':>10}")
+    for rows in sizes:
+        data = backtest_data(build_tables(replicate_master(master, rows)))
+        strategy_seconds = time_call(lambda: [run_strategy(data, strategy, parameters)
+                                              for strategy, parameters in DEFAULT_PARAMETERS.items()])
+        serial_seconds = time_call(lambda: sweep(data, configurations), repeat=1)
+        pool_seconds = time_call(lambda: sweep(data, configurations, workers=4), repeat=1)
+        print(f"{rows:>10} {len(data['fight_id']):>8} {strategy_seconds / len(DEFAULT_PARAMETERS) * 1000:>12.3f} "
+              f"{len(configurations) / serial_seconds:>12.0f} {len(configurations) / pool_seconds:>10.0f}")
+
+# A misspelling of a name the way other sources write it: a typo, an accent, a nickname or the words reversed
+def vary_name(name, rng):
+    kind = rng.integers(5)
+    position = rng.integers(1, len(name) - 1)
+    if kind == 0:  # One letter replaced
+        return name[:position] + chr(rng.integers(97, 123)) + name[position + 1:]
+    if kind == 1:  # One letter dropped
+        return name[:position] + name[position + 1:]
+    if kind == 2:  # Two letters swapped
+        return name[:position - 1] + name[position] + name[position - 1] + name[position + 1:]
+    if kind == 3:
+        return name.replace('a', 'á', 1).replace('e', 'é', 1)
+    first, _, rest = name.partition(' ')
+    return f'{rest} {first}' if rest else name
+
+# Names of an incoming source: known spellings, variants of them and (share `unknown`) names of new fighters.
+# Returns the names with the fighter_id each stands for, NA for the new fighters.
+def incoming_names(known, count, rng, variants=0.3, unknown=0.1):
+    picks = known.iloc[rng.integers(len(known), size=count)].reset_index(drop=True)
+    names = picks['alias_name'].to_numpy(dtype=object, copy=True)
+    fighter_ids = pd.array(picks['fighter_id'], dtype='Int64')
+
+    kind = rng.random(count)
+    for i in np.flatnonzero(kind < variants):
+        names[i] = vary_name(names[i], rng)
+    new = np.flatnonzero(kind > 1 - unknown)
+    syllables = np.array(['ka', 'ro', 'mi', 'zen', 'tal', 'vo', 'su', 'rik', 'an', 'del', 'po', 'gu'])
+    for i in new:
+        names[i] = ' '.join(''.join(rng.choice(syllables, 3)).title() for _ in range(2))
+    fighter_ids[new] = pd.NA
+    return pd.Series(names), fighter_ids
+
+# Resolving incoming names against the fighters of the master file: names per second, the share resolved by exact
+# key and by fuzzy match, the candidate pairs scored against all pairs, and how often the resolved id is right
+def bench_names(master, sizes):
+    sizes = sizes or [100000]
+    rng = np.random.default_rng(0)
+    known = known_aliases(build_tables(master))
+    index = FighterNameIndex(known)
+
+    print(f"{'names':>8} {'names/s':>9} {'exact':>6} {'fuzzy':>6} {'none':>6} {'correct':>8} {'wrong':>6} "
+          f"{'brute force s':>14}")
+    for count in sizes:
+        names, truth = incoming_names(known, count, rng)
+        seconds = time_call(index.resolve, names, repeat=1)
+        resolved = index.resolve(names)
+
+        exact = (resolved['match_score'] == 1).mean()
+        fuzzy = (resolved['match_score'] < 1).mean()
+        found = resolved['fighter_id'].notna().to_numpy()
+        correct = (resolved['fighter_id'].fillna(-1).to_numpy() == truth.fillna(-1).to_numpy()).mean()
+        wrong = (found & (resolved['fighter_id'].fillna(-1).to_numpy() != truth.fillna(-1).to_numpy())).mean()
+
+        # Scoring every distinct incoming name against every known name, timed on a sample and scaled up
+        distinct = name_keys(names.drop_duplicates())['match_key']
+        sample = distinct.iloc[:20]
+        known_keys = index.entries['match_key']
+        start = time.perf_counter()
+        for key in sample:
+            similarity([key] * len(known_keys), known_keys)
+        brute_seconds = (time.perf_counter() - start) / len(sample) * len(distinct)
+
+        print(f"{count:>8} {count / seconds:>9.0f} {exact:>6.1%} {fuzzy:>6.1%} {1 - exact - fuzzy:>6.1%} "
+              f"{correct:>8.1%} {wrong:>6.2%} {brute_seconds:>14.0f}")
+
+# Results of the suite that later runs are compared with
+SUITE_BASELINE = 'benchmark_baseline.json'
+
+# Empties every table the ETL loads, so each size is a full load into an empty database
+def empty_database(engine):
+    with engine.begin() as conn:
+        conn.execute(text(f"TRUNCATE {', '.join(PRIMARY_KEYS)}, etl_watermarks RESTART IDENTITY CASCADE"))
+
+def print_summary(summary):
+    print(f"{'stage':>36} {'calls':>6} {'seconds':>9} {'cpu s':>8} {'rows out':>10} {'peak MB':>8} {'trips':>6}")
+    for stage, total in summary.items():
+        rows_out = '' if total['rows_out'] is None else total['rows_out']
+        peak = '' if total['peak_memory_delta_mb'] is None else f"{total['peak_memory_delta_mb']:.1f}"
+        print(f"{stage:>36} {total['calls']:>6} {total['wall_seconds']:>9.3f} {total['cpu_seconds']:>8.3f} "
+              f"{rows_out:>10} {peak:>8} {total['round_trips']:>6}")
+
+# Writes the synthetic master file of one size, in its own process so its memory is returned before the run
+def suite_master(template_path, rows, path):
+    write_synthetic_master(template_path, rows, path)
+
+# Reads one synthetic master file, builds every table with the create_* functions and, with a database, runs the
+# full load into it after emptying it. Runs in its own process, so the peak resident memory is that of this size alone.
+def suite_run(path, database_url=None):
+    engine = None
+    if database_url:
+        engine = create_engine(database_url)
+        watch_engine(engine)
+        empty_database(engine)
+
+    report = RunReport().start()
+    df = read_master(path)
+    tables = build_tables(df)
+    if engine is not None:
+        run_full_load(engine, tables, watermark_of(df))
+    report.stop()
+
+    run = report.to_dict()
+    run['master_mb'] = df.memory_usage(deep=True).sum() / 2 ** 20
+    run['peak_rss_mb'] = max_rss_mb()
+    return {key: run[key] for key in ['wall_seconds', 'cpu_seconds', 'round_trips', 'master_mb', 'peak_rss_mb',
+                                      'git_commit', 'summary']}
+
+# Runs the pipeline on a synthetic master file of every size, each in a fresh process. A size whose process dies
+# (usually killed for running out of memory) is recorded with the error and the next size still runs. The results
+# are compared with the baseline file when it exists, and replace it with save_baseline.
+def bench_suite(template_path, sizes, database_url=None, baseline_path=SUITE_BASELINE, save_baseline=False,
+                threshold=0.2):
+    sizes = sizes or [10000, 100000, 1000000]
+    database = create_engine(database_url).dialect.name if database_url else None
+    results = {'template': template_path, 'database': database, 'sizes': {}}
+    for rows in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, f'synthetic-{rows}.csv')
+            try:
+                with ProcessPoolExecutor(max_workers=1) as executor:
+                    executor.submit(suite_master, template_path, rows, path).result()
+                with ProcessPoolExecutor(max_workers=1) as executor:
+                    run = executor.submit(suite_run, path, database_url).result()
+            except BrokenProcessPool as error:
+                results['sizes'][str(rows)] = {'error': f'{type(error).__name__}: {error}'}
+                print(f"{rows} rows: the worker process died ({error})")
+                continue
+
+        results['sizes'][str(rows)] = run
+        print(f"{rows} rows: {run['wall_seconds']:.2f}s, master frame {run['master_mb']:.0f} MB, "
+              f"peak resident memory {run['peak_rss_mb']:.0f} MB")
+        print_summary(run['summary'])
+
+    if baseline_path and os.path.exists(baseline_path):
+        with open(baseline_path) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline['database'] != results['database']:
+            print(f"The baseline ran with database {baseline['database']} and this run with {results['database']}, "
+                  f"so only the stages of both are compared")
+        for size, run in results['sizes'].items():
+            old = baseline['sizes'].get(size)
+            if old is None or 'error' in old or 'error' in run:
+                continue
+            comparison = compare_reports(old, run, threshold)
+            regressed = comparison[comparison['regressed'] != '']
+            print(f"{size} rows against {baseline_path}: {run['wall_seconds']:.2f}s "
+                  f"(baseline {old['wall_seconds']:.2f}s), peak {run['peak_rss_mb']:.0f} MB "
+                  f"(baseline {old['peak_rss_mb']:.0f} MB)")
+            print(regressed.round(3).to_string(index=False) if len(regressed) > 0 else 'No stage regressed')
+
+    if save_baseline:
+        with open(baseline_path, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+        print(f"Saved the results as the baseline {baseline_path}")
+
+BENCHMARKS = {
+    'rankings': bench_rankings,
+    'cleaning': bench_cleaning,
+    'memory': bench_memory,
+    'transform': bench_transform,
+    'history': bench_history,
+    'ratings': bench_ratings,
+    'backtest': bench_backtest,
+    'names': bench_names
+}
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the ETL transforms')
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS) + ['suite'], help='Benchmark to run')
+    parser.add_argument('--csv', default='ufc-master.csv', help='Path to the master CSV file to replicate')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        help='Row counts of the synthetic master files (each benchmark has its own default)')
+    parser.add_argument('--database-url', help='Scratch PostgreSQL database the suite empties and fully loads')
+    parser.add_argument('--baseline', default=SUITE_BASELINE, help='Results of an earlier suite run to compare with')
+    parser.add_argument('--save-baseline', action='store_true', help='Store the results of the suite as the baseline')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Relative growth of a stage that the suite reports as a regression')
+    args = parser.parse_args()
+
+    if args.benchmark == 'suite':
+        bench_suite(args.csv, args.sizes, args.database_url, args.baseline, args.save_baseline, args.threshold)
+        return
+
+    master = read_master(args.csv)
+    BENCHMARKS[args.benchmark](master, args.sizes)
+
+if __name__ == '__main__':
+    main()
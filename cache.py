@@ -0,0 +1,106 @@
+# Content-addressed cache of the transformed tables, keyed by the master CSV contents and the transform code,
+# so reruns against a new database target or after a schema tweak skip the parse and transform steps
+
+import hashlib
+import json
+import os
+import shutil
+import time
+
+try:
+    import pyarrow as pa
+except ImportError:  # Without pyarrow every run recomputes the tables
+    pa = None
+
+from instrument import timed_stage, tables_rows
+
+CACHE_DIR = '.etl_cache'
+MAX_AGE_DAYS = 30
+MAX_SIZE_MB = 2048
+
+def file_digest(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+@timed_stage
+def cache_key(csv_path, code_version):
+    return hashlib.sha256(f'{file_digest(csv_path)}:{code_version}'.encode('utf-8')).hexdigest()
+
+def entry_size(entry):
+    return sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+
+# Tables of a cache entry as (table name, dataframe) pairs plus the metadata stored with them, or None on a miss.
+# The Arrow files are memory-mapped, so unchanged buffers are read straight from the page cache.
+@timed_stage(rows_out=tables_rows)
+def read_cached_tables(cache_dir, key):
+    entry = os.path.join(cache_dir, key)
+    manifest_path = os.path.join(entry, 'manifest.json')
+    if pa is None or not os.path.exists(manifest_path):
+        return None
+
+    with open(manifest_path) as manifest_file:
+        manifest = json.load(manifest_file)
+
+    tables = []
+    for table_name in manifest['tables']:
+        source = pa.memory_map(os.path.join(entry, f'{table_name}.arrow'))
+        tables.append((table_name, pa.ipc.open_file(source).read_all().to_pandas()))
+
+    # The modification time of an entry is its last use, which is what eviction goes by
+    os.utime(entry)
+    return tables, manifest['metadata']
+
+# Writes the tables as uncompressed Arrow IPC files, which can be memory-mapped on a hit.
+# The entry is written under a temporary name and renamed, so a crash never leaves a partial entry behind.
+@timed_stage
+def write_cached_tables(cache_dir, key, tables, metadata):
+    if pa is None:
+        print('pyarrow is not installed, the transformed tables are not cached')
+        return
+
+    entry = os.path.join(cache_dir, key)
+    staging = f'{entry}.{os.getpid()}.tmp'
+    os.makedirs(staging, exist_ok=True)
+
+    for table_name, df in tables:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        with pa.OSFile(os.path.join(staging, f'{table_name}.arrow'), 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+    with open(os.path.join(staging, 'manifest.json'), 'w') as manifest_file:
+        json.dump({'tables': [table_name for table_name, _ in tables], 'metadata': metadata,
+                   'created_at': time.time()}, manifest_file)
+
+    if os.path.exists(entry):
+        shutil.rmtree(staging)
+    else:
+        os.replace(staging, entry)
+
+# Drops entries unused for longer than max_age_days, then the least recently used ones until the cache fits in max_size_mb
+@timed_stage
+def evict_cache(cache_dir, max_age_days=MAX_AGE_DAYS, max_size_mb=MAX_SIZE_MB):
+    if not os.path.isdir(cache_dir):
+        return
+
+    now = time.time()
+    entries = []
+    for name in os.listdir(cache_dir):
+        entry = os.path.join(cache_dir, name)
+        if not os.path.isdir(entry):
+            continue
+        last_used = os.path.getmtime(entry)
+        if now - last_used > max_age_days * 86400:
+            shutil.rmtree(entry)
+        elif not name.endswith('.tmp'):  # Entries still being written by another run are left alone
+            entries.append((last_used, entry_size(entry), entry))
+
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries):
+        if total_size <= max_size_mb * 1024 * 1024:
+            break
+        shutil.rmtree(entry)
+        total_size -= size
@@ -0,0 +1,135 @@
+# Point-in-time index of every fighter's fight history, built from the tables the ETL produces.
+# The per-fight rows of all fighters are kept in one frame sorted by (fighter_id, event date, fight_id), so the
+# history of a fighter is a contiguous slice and "what did fighter X look like as of date D" is a binary search.
+
+import numpy as np
+import pandas as pd
+
+from ETL import STATS_COLUMNS, RANKING_COLUMNS, build_tables_cached, canonical_fighter_names
+from resolve import FighterNameIndex, known_aliases
+
+# A fighter_id and a day number packed into one sortable int64, so a single searchsorted answers a whole batch
+KEY_SPAN = 1 << 32
+
+NANOSECONDS_PER_DAY = 86400 * 10 ** 9
+
+# Days since 1970-01-01 of dates given as strings, datetimes or datetime64 values
+def to_days(dates):
+    return pd.to_datetime(pd.Series(dates)).to_numpy(dtype='datetime64[D]').astype(np.int64)
+
+def to_day(date):
+    return pd.Timestamp(date).value // NANOSECONDS_PER_DAY
+
+# fighter_ids as int64, with missing ids (fighters not in the index) as -1, which never matches a row
+def as_ids(fighter_ids):
+    return pd.array(fighter_ids, dtype='Int64').fillna(-1).to_numpy(dtype='int64')
+
+class FighterHistory:
+    def __init__(self, tables):
+        tables = dict(tables)
+        event_dates = dict(zip(tables['events']['event_id'], tables['events']['event_date']))
+
+        fights = tables['fights'][['fight_id', 'event_id', 'red_fighter_id', 'blue_fighter_id', 'winner_color',
+                                   'finish_method', 'title_bout']]
+        fights = fights.assign(event_date=pd.to_datetime(fights['event_id'].map(event_dates)))
+
+        ranks = tables['fighter_rankings'][['fight_id', 'corner_color'] + RANKING_COLUMNS].rename(
+            columns={'corner_color': 'fighter_corner'})
+        rows = tables['fighter_stats_per_fight'][['fight_id', 'fighter_id', 'fighter_corner'] + STATS_COLUMNS]
+        rows = rows.dropna(subset=['fighter_id']).merge(ranks, on=['fight_id', 'fighter_corner'], how='left')
+        rows = rows.merge(fights, on='fight_id', how='left')
+
+        # Result of the fight for this fighter: NA when the fight has no winner
+        is_red = rows['fighter_corner'] == 'Red'
+        rows['opponent_id'] = rows['blue_fighter_id'].where(is_red, rows['red_fighter_id'])
+        rows['won'] = pd.Series(rows['winner_color'].astype('object') == rows['fighter_corner'].astype('object'),
+                                dtype='boolean').where(rows['winner_color'].isin(['Red', 'Blue']))
+
+        rows = rows.drop(columns=['red_fighter_id', 'blue_fighter_id']).astype({'fighter_id': 'int64'})
+        self.rows = rows.sort_values(['fighter_id', 'event_date', 'fight_id'], kind='stable').reset_index(drop=True)
+
+        self.fighter_ids = self.rows['fighter_id'].to_numpy()
+        self.keys = self.fighter_ids * KEY_SPAN + to_days(self.rows['event_date'])
+
+        # Every known spelling resolves exactly through the alias map, other spellings through the name index
+        aliases = tables['fighter_aliases']
+        self.fighter_mapping = dict(zip(aliases['alias_name'], aliases['fighter_id']))
+        self.name_index = FighterNameIndex(known_aliases(tables))
+
+    # Index of the cached (or freshly built) tables of a master CSV
+    @classmethod
+    def from_csv(cls, csv_path='ufc-master.csv'):
+        tables, _ = build_tables_cached(csv_path)
+        return cls(tables)
+
+    def fighter_id(self, name):
+        fighter_id = self.fighter_mapping.get(canonical_fighter_names(pd.Series([name])).iloc[0])
+        if fighter_id is None:
+            fighter_id = self.name_index.resolve(pd.Series([name]))['fighter_id'].iloc[0]
+        return None if pd.isna(fighter_id) else int(fighter_id)
+
+    # Row position of each fighter's last fight before each date (on or before it with inclusive=True), -1 if none
+    def positions(self, fighter_ids, dates, inclusive=False):
+        fighter_ids = as_ids(fighter_ids)
+        keys = fighter_ids * KEY_SPAN + to_days(dates)
+        positions = np.searchsorted(self.keys, keys, side='right' if inclusive else 'left') - 1
+        found = (positions >= 0) & (self.fighter_ids[positions.clip(0)] == fighter_ids)
+        return np.where(found, positions, -1)
+
+    # Scalar version of positions, without the array conversions, for one-off lookups
+    def position(self, fighter_id, date, inclusive=False):
+        position = int(np.searchsorted(self.keys, fighter_id * KEY_SPAN + to_day(date),
+                                       side='right' if inclusive else 'left')) - 1
+        return position if position >= 0 and self.fighter_ids[position] == fighter_id else -1
+
+    # Row of each (fighter, date) pair as of that date, one per pair and all missing when the fighter had no fight yet
+    def as_of_batch(self, fighter_ids, dates, inclusive=False):
+        return self.rows.reindex(self.positions(fighter_ids, dates, inclusive)).reset_index(drop=True)
+
+    # One fighter's last fight before a date as a Series, or None
+    def as_of(self, fighter_id, date, inclusive=False):
+        position = self.position(fighter_id, date, inclusive)
+        return None if position < 0 else self.rows.iloc[position]
+
+    # One fighter's last n fights before a date, oldest first
+    def last_n(self, fighter_id, date, n, inclusive=False):
+        end = self.position(fighter_id, date, inclusive) + 1
+        start = np.searchsorted(self.keys, fighter_id * KEY_SPAN)
+        return self.rows.iloc[max(start, end - n):end] if end > 0 else self.rows.iloc[0:0]
+
+    # Last n fights before the date of every (fighter, date) pair, oldest first, with `query` the position of the pair
+    def last_n_batch(self, fighter_ids, dates, n, inclusive=False):
+        fighter_ids = as_ids(fighter_ids)
+        ends = self.positions(fighter_ids, dates, inclusive) + 1
+        starts = np.maximum(np.searchsorted(self.keys, fighter_ids * KEY_SPAN), ends - n)
+        counts = np.where(ends > 0, ends - starts, 0)
+
+        query = np.repeat(np.arange(len(fighter_ids)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        history = self.rows.take(np.repeat(starts, counts) + offsets)
+        return history.assign(query=query).reset_index(drop=True)
+
+    # As-of rows of both corners of every fight of a card, as red_* and blue_* columns beside the card.
+    # The card needs red_fighter_id, blue_fighter_id and event_date.
+    def lookup_card(self, card, inclusive=False):
+        sides = []
+        for corner in ['red', 'blue']:
+            side = self.as_of_batch(card[f'{corner}_fighter_id'], card['event_date'], inclusive)
+            sides.append(side.drop(columns=['fighter_id']).add_prefix(f'{corner}_').set_axis(card.index))
+        return pd.concat([card] + sides, axis=1)
+
+    # Card of a master-format frame such as upcoming.csv, with the fighters resolved to their ids (NA when unknown).
+    # Names that are not a known alias are matched by the name index, with the card's gender and heights as evidence.
+    def card_from_master(self, df):
+        return pd.DataFrame({
+            'red_fighter_id': self.resolve_corner(df['RedFighter'], df['Gender'], df['RedHeightCms']),
+            'blue_fighter_id': self.resolve_corner(df['BlueFighter'], df['Gender'], df['BlueHeightCms']),
+            'event_date': pd.to_datetime(df['Date'])
+        }, index=df.index)
+
+    def resolve_corner(self, names, gender, height_cms):
+        fighter_ids = canonical_fighter_names(names).map(self.fighter_mapping).astype('Int64')
+        unknown = fighter_ids.isna() & names.notna()
+        if unknown.any():
+            fighter_ids[unknown] = self.name_index.resolve(names[unknown], gender[unknown], height_cms[unknown])['fighter_id']
+        return fighter_ids
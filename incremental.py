@@ -0,0 +1,93 @@
+# Database state used by the incremental ETL mode: the watermark of the last loaded
+# event date and the surrogate keys that already exist for fighters, events and fights
+
+import hashlib
+
+import pandas as pd
+from sqlalchemy import text
+
+from instrument import timed_stage
+
+# Primary key of every table the ETL loads, used to continue the surrogate keys
+PRIMARY_KEYS = {
+    'fighters': 'fighter_id',
+    'fighter_aliases': 'alias_id',
+    'events': 'event_id',
+    'fights': 'fight_id',
+    'fighter_stats_per_fight': 'stat_id',
+    'betting_odds': 'odds_id',
+    'fighter_rankings': 'ranking_id',
+    'fight_differentials': 'differential_id'
+}
+
+# Hash of the rows of a set of fights, used to tell if a card changed since it was loaded
+def hash_fight_rows(rows):
+    digest = hashlib.sha256()
+    for row in sorted(rows):
+        digest.update('|'.join(str(part) for part in row).encode('utf-8'))
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+@timed_stage
+def read_watermark(engine):
+    with engine.connect() as conn:
+        row = conn.execute(text(
+            "SELECT last_event_date, last_event_hash FROM etl_watermarks ORDER BY watermark_id DESC LIMIT 1"
+        )).fetchone()
+
+    if row is None:
+        return None
+
+    return {'last_event_date': row.last_event_date.isoformat(), 'last_event_hash': row.last_event_hash}
+
+@timed_stage
+def write_watermark(engine, last_event_date, last_event_hash, fights_loaded):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO etl_watermarks (last_event_date, last_event_hash, fights_loaded) "
+            "VALUES (:last_event_date, :last_event_hash, :fights_loaded)"
+        ), {'last_event_date': last_event_date, 'last_event_hash': last_event_hash, 'fights_loaded': fights_loaded})
+
+# Every alias with the fighter it names and the fighter's gender and height, which the name resolution compares
+@timed_stage
+def fetch_known_aliases(engine):
+    with engine.connect() as conn:
+        return pd.read_sql(text(
+            "SELECT a.alias_name, a.fighter_id, f.fighter_name, f.gender::text AS gender, "
+            "f.height_cms::float8 AS height_cms "
+            "FROM fighter_aliases a "
+            "JOIN fighters f ON f.fighter_id = a.fighter_id"
+        ), conn)
+
+@timed_stage
+def fetch_existing_events(engine):
+    with engine.connect() as conn:
+        events = pd.read_sql(text("SELECT event_date, event_location, event_id FROM events"), conn)
+
+    # The master CSV keeps dates as ISO strings, so the natural key is compared in that form
+    events['event_date'] = pd.to_datetime(events['event_date']).dt.strftime('%Y-%m-%d')
+    return events
+
+# Statement deleting the fights loaded on or after a date, for the loader to run in the transaction that loads
+# them again. Their stats, odds, rankings, differentials and ratings go with them through ON DELETE CASCADE.
+def delete_fights_since(since_date):
+    return ("DELETE FROM fights f USING events e WHERE e.event_id = f.event_id AND e.event_date >= %(since_date)s",
+            {'since_date': since_date})
+
+@timed_stage
+def fetch_max_ids(engine):
+    max_ids = {}
+    with engine.connect() as conn:
+        for table_name, key in PRIMARY_KEYS.items():
+            max_ids[table_name] = conn.execute(text(f"SELECT COALESCE(MAX({key}), 0) FROM {table_name}")).scalar()
+    return max_ids
+
+# Explicit ids bypass the SERIAL sequences, so move them past the loaded keys
+@timed_stage
+def sync_sequences(engine):
+    with engine.begin() as conn:
+        for table_name, key in PRIMARY_KEYS.items():
+            conn.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table_name}', '{key}'), "
+                f"COALESCE(MAX({key}), 0) + 1, false) FROM {table_name}"
+            ))
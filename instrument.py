@@ -0,0 +1,401 @@
+# Stage instrumentation for the ETL. While a RunReport is active, every stage records its wall time, CPU time, rows in
+# and out, peak memory growth and database round-trips, and the report is written as JSON. Without an active report
+# the stages cost one global lookup. `python instrument.py old.json new.json` compares two reports stage by stage.
+
+import argparse
+import contextvars
+import cProfile
+import json
+import platform
+import pstats
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from functools import wraps
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import event
+
+try:
+    import psutil
+except ImportError:  # Without psutil the peak memory is the growth of the process high-water mark
+    psutil = None
+
+try:
+    import resource
+except ImportError:  # Windows has neither resource nor ru_maxrss
+    resource = None
+
+# How often the memory sampler reads the resident set size
+SAMPLE_SECONDS = 0.005
+
+PROFILERS = ['cprofile', 'tracemalloc']
+
+# Functions and allocation sites kept in the report of a profiled stage
+PROFILE_TOP = 25
+
+# Report the stages are recorded into, set by RunReport.start
+active_report = None
+
+# Stages open in the current thread or task, innermost last. Threads started with contextvars.copy_context() see
+# the stages of the thread that started them, so their stages nest under it.
+open_stages = contextvars.ContextVar('open_stages', default=())
+
+# Rows of a dataframe or array, or the summed rows of a list of (table name, dataframe) pairs; None for anything else
+def row_count(value):
+    if hasattr(value, 'shape') and len(value.shape) > 0:
+        return int(value.shape[0])
+    if isinstance(value, list) and value and all(isinstance(item, tuple) and len(item) == 2 for item in value):
+        counts = [row_count(frame) for _, frame in value]
+        return None if None in counts else sum(counts)
+    return None
+
+# Rows of the tables of a (tables, metadata) result, None for a cache miss
+def tables_rows(result):
+    return None if result is None else row_count(result[0])
+
+def first_row_count(args):
+    for arg in args:
+        rows = row_count(arg)
+        if rows is not None:
+            return rows
+    return None
+
+def mebibytes(size):
+    return size / 2 ** 20
+
+# Process high-water mark in MiB; ru_maxrss is in KiB on Linux and in bytes on macOS
+def max_rss_mb():
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return mebibytes(max_rss) if sys.platform == 'darwin' else max_rss / 1024
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+class RunReport:
+    def __init__(self, profile_stage=None, profiler='cprofile'):
+        if profiler not in PROFILERS:
+            raise ValueError(f"Unknown profiler {profiler}, expected one of {', '.join(PROFILERS)}")
+        self.profile_stage = profile_stage
+        self.profiler = profiler
+        self.profile = None          # cProfile.Profile of the profiled stage, accumulated over its calls
+        self.metadata = {}
+        self.stages = []             # finished stage records, in the order they finished
+        self.running = []            # open stage records, whose peaks the sampler raises
+        self.round_trips = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.sampler = None
+        self.process = psutil.Process() if psutil is not None else None
+
+    def memory_source(self):
+        if self.process is not None:
+            return 'rss sampled every %g ms' % (SAMPLE_SECONDS * 1000)
+        return 'growth of ru_maxrss' if resource is not None else None
+
+    # A worker process passes the start_counter of its parent's report, so the start_seconds of its stages are on
+    # the parent's clock. perf_counter is system-wide, so both processes read the same clock.
+    def start(self, start_counter=None):
+        global active_report
+        self.started_at = time.time()
+        self.start_counter = time.perf_counter() if start_counter is None else start_counter
+        self.start_cpu = time.process_time()
+        if self.process is not None:
+            self.sampler = threading.Thread(target=self.sample_memory, name='memory-sampler', daemon=True)
+            self.sampler.start()
+        active_report = self
+        return self
+
+    def stop(self):
+        global active_report
+        if active_report is self:
+            active_report = None
+        self.wall_seconds = time.perf_counter() - self.start_counter
+        self.cpu_seconds = time.process_time() - self.start_cpu
+        self.stopped.set()
+        if self.sampler is not None:
+            self.sampler.join()
+
+    def memory_mb(self):
+        if self.process is not None:
+            return mebibytes(self.process.memory_info().rss)
+        return max_rss_mb() if resource is not None else None
+
+    # One thread raises the peak of every open stage, so nested and concurrent stages each get their own peak
+    def sample_memory(self):
+        while not self.stopped.wait(SAMPLE_SECONDS):
+            self.raise_peaks(self.memory_mb())
+
+    def raise_peaks(self, memory):
+        with self.lock:
+            for record in self.running:
+                record['peak_mb'] = max(record['peak_mb'], memory)
+
+    # Counted on every open stage of the caller, so a stage's round-trips include those of its nested stages
+    def count_round_trips(self, count):
+        with self.lock:
+            self.round_trips += count
+            for record in open_stages.get():
+                record['round_trips'] += count
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        stages = open_stages.get()
+        memory = self.memory_mb()
+        record = {
+            'stage': name,
+            'parent': stages[-1]['stage'] if stages else None,
+            'thread': threading.current_thread().name,
+            'start_seconds': time.perf_counter() - self.start_counter,
+            'wall_seconds': None,
+            'cpu_seconds': None,
+            'rows_in': rows_in,
+            'rows_out': None,
+            'memory_before_mb': memory,
+            'peak_mb': memory,
+            'round_trips': 0
+        }
+        with self.lock:
+            self.running.append(record)
+        token = open_stages.set(stages + (record,))
+
+        profiling = name == self.profile_stage
+        if profiling:
+            self.start_profile(record)
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        except BaseException as error:
+            record['error'] = f'{type(error).__name__}: {error}'
+            raise
+        finally:
+            record['wall_seconds'] = time.perf_counter() - start_wall
+            record['cpu_seconds'] = time.process_time() - start_cpu
+            if profiling:
+                self.stop_profile(record)
+            open_stages.reset(token)
+            if memory is not None:
+                self.raise_peaks(self.memory_mb())
+            with self.lock:
+                self.running.remove(record)
+                self.stages.append(record)
+
+    # Adds the stages a worker process recorded. Its outermost stages nest under the stage open here.
+    def add_stages(self, records, worker_name):
+        stages = open_stages.get()
+        with self.lock:
+            for record in records:
+                if record['parent'] is None:
+                    record['parent'] = stages[-1]['stage'] if stages else None
+                record['thread'] = worker_name
+                self.stages.append(record)
+
+    def start_profile(self, record):
+        record['profiled'] = self.profiler
+        if self.profiler == 'cprofile':
+            self.profile = self.profile or cProfile.Profile()
+            self.profile.enable()
+        else:
+            record['tracemalloc_started'] = not tracemalloc.is_tracing()
+            if record['tracemalloc_started']:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+
+    def stop_profile(self, record):
+        if self.profiler == 'cprofile':
+            self.profile.disable()
+            return
+
+        # Allocations of the stage still alive at its end, by source line, and the peak of traced memory during it
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, '<frozen importlib._bootstrap*>')])
+        record['traced_peak_mb'] = mebibytes(tracemalloc.get_traced_memory()[1])
+        record['allocations'] = [
+            {'line': str(statistic.traceback), 'size_mb': mebibytes(statistic.size), 'count': statistic.count}
+            for statistic in snapshot.statistics('lineno')[:PROFILE_TOP]
+        ]
+        if record.pop('tracemalloc_started'):
+            tracemalloc.stop()
+
+    # Stage records as the report lists them, in start order and with the peak memory as growth over the memory at
+    # the start of the stage. The stored records are left as they are, so a report can be built more than once.
+    def finished_stages(self):
+        stages = []
+        for record in self.stages:
+            stage = {key: value for key, value in record.items() if key not in ['peak_mb', 'memory_before_mb']}
+            before = record['memory_before_mb']
+            stage['peak_memory_delta_mb'] = None if before is None else record['peak_mb'] - before
+            stages.append(stage)
+        return sorted(stages, key=lambda stage: stage['start_seconds'])
+
+    # Totals per stage name: summed times, rows and round-trips, and the largest peak of any call
+    def summary(self):
+        summary = {}
+        for record in self.finished_stages():
+            total = summary.setdefault(record['stage'], {
+                'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'rows_in': None, 'rows_out': None,
+                'peak_memory_delta_mb': None, 'round_trips': 0})
+            total['calls'] += 1
+            total['wall_seconds'] += record['wall_seconds']
+            total['cpu_seconds'] += record['cpu_seconds']
+            total['round_trips'] += record['round_trips']
+            for key in ['rows_in', 'rows_out']:
+                if record[key] is not None:
+                    total[key] = (total[key] or 0) + record[key]
+            if record['peak_memory_delta_mb'] is not None:
+                total['peak_memory_delta_mb'] = max(total['peak_memory_delta_mb'] or 0.0, record['peak_memory_delta_mb'])
+        return summary
+
+    # Top functions of the profiled stage by cumulative time; the full statistics go to `stats_path` for pstats
+    # or snakeviz
+    def profile_statistics(self, stats_path):
+        self.profile.dump_stats(stats_path)
+        stats = pstats.Stats(self.profile)
+        rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:PROFILE_TOP]
+        return {
+            'stats_file': stats_path,
+            'top': [{'function': f'{path}:{line}({function})', 'calls': calls, 'total_seconds': total_time,
+                     'cumulative_seconds': cumulative_time}
+                    for (path, line, function), (_, calls, total_time, cumulative_time, _) in rows]
+        }
+
+    # The cProfile statistics of a profiled stage are written next to the report at `path`
+    def to_dict(self, path='report.json'):
+        report = {
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(self.started_at)),
+            'command': sys.argv,
+            'git_commit': git_commit(),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'memory_source': self.memory_source(),
+            **self.metadata,
+            'wall_seconds': self.wall_seconds,
+            'cpu_seconds': self.cpu_seconds,
+            'round_trips': self.round_trips,
+            'summary': self.summary(),
+            'stages': self.finished_stages()
+        }
+        if self.profile is not None:
+            report['profile'] = {'stage': self.profile_stage, **self.profile_statistics(
+                path.rsplit('.json', 1)[0] + f'.{self.profile_stage}.prof')}
+        return report
+
+    def write(self, path):
+        with open(path, 'w') as report_file:
+            json.dump(self.to_dict(path), report_file, indent=2, default=str)
+        print(f"Wrote the run report of {len(self.stages)} stages to {path}")
+
+# Initializer of worker processes. A forked worker inherits the parent's report, whose lock another thread may
+# have held at the fork, so the worker drops it along with the open stages and records into a report of its own.
+def detach_report():
+    global active_report
+    active_report = None
+    open_stages.set(())
+
+# Records the block as a stage of the active report, if there is one. The record is yielded so that the block can
+# fill in rows_out (or rows_in) once it knows them.
+@contextmanager
+def stage(name, rows_in=None):
+    report = active_report
+    if report is None:
+        yield {}
+        return
+    with report.stage(name, rows_in) as record:
+        yield record
+
+# Decorator recording every call of a function as a stage named after it. Rows in are those of the first dataframe
+# (or list of tables) among the arguments, rows out those of the result, or what `rows_out` makes of the result.
+def timed_stage(function=None, name=None, rows_out=row_count):
+    def decorate(function):
+        stage_name = name or function.__name__
+
+        @wraps(function)
+        def timed(*args, **kwargs):
+            report = active_report
+            if report is None:
+                return function(*args, **kwargs)
+            with report.stage(stage_name, first_row_count(args)) as record:
+                result = function(*args, **kwargs)
+                record['rows_out'] = rows_out(result)
+            return result
+        return timed
+
+    return decorate(function) if function is not None else decorate
+
+def count_round_trips(count=1):
+    report = active_report
+    if report is not None:
+        report.count_round_trips(count)
+
+# Counts every statement, commit and rollback SQLAlchemy sends over the engine. Raw DBAPI connections bypass these
+# events, so the loader counts its COPY statements and commits itself.
+def watch_engine(engine):
+    for event_name in ['before_cursor_execute', 'commit', 'rollback']:
+        event.listen(engine, event_name, lambda *args, **kwargs: count_round_trips())
+
+# Runs `function` in a thread pool with the open stages of the caller, so the stages it records nest under them
+def with_stages(executor, function, *args):
+    return executor.submit(contextvars.copy_context().run, function, *args)
+
+# Stage totals of two reports side by side. A stage regressed when its time grew by more than `threshold` (and by
+# at least `min_seconds`), its peak memory by more than `threshold` (and at least `min_mb`), or it made more
+# round-trips.
+def compare_reports(old, new, threshold=0.2, min_seconds=0.05, min_mb=16):
+    rows = []
+    for name in list(new['summary']) + [name for name in old['summary'] if name not in new['summary']]:
+        before, after = old['summary'].get(name), new['summary'].get(name)
+        row = {'stage': name}
+        for metric in ['wall_seconds', 'cpu_seconds', 'peak_memory_delta_mb', 'round_trips']:
+            row[f'old_{metric}'] = before[metric] if before else None
+            row[f'new_{metric}'] = after[metric] if after else None
+
+        regressions = []
+        if before and after:
+            for metric, floor in [('wall_seconds', min_seconds), ('cpu_seconds', min_seconds),
+                                  ('peak_memory_delta_mb', min_mb)]:
+                if before[metric] is not None and after[metric] is not None \
+                        and after[metric] - before[metric] > max(floor, threshold * before[metric]):
+                    regressions.append(metric)
+            if after['round_trips'] > before['round_trips']:
+                regressions.append('round_trips')
+        row['regressed'] = ', '.join(regressions)
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+def load_report(path):
+    with open(path) as report_file:
+        return json.load(report_file)
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare two ETL run reports stage by stage')
+    parser.add_argument('old', help='Report of the baseline run')
+    parser.add_argument('new', help='Report of the run checked for regressions')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Relative growth that counts as a regression')
+    parser.add_argument('--min-seconds', type=float, default=0.05, help='Ignore time growth smaller than this')
+    parser.add_argument('--min-mb', type=float, default=16, help='Ignore peak memory growth smaller than this')
+    args = parser.parse_args()
+
+    old, new = load_report(args.old), load_report(args.new)
+    comparison = compare_reports(old, new, args.threshold, args.min_seconds, args.min_mb)
+    pd.set_option('display.width', 250)
+    print(comparison.round(3).to_string(index=False))
+    print(f"Total wall time {old['wall_seconds']:.2f}s -> {new['wall_seconds']:.2f}s, "
+          f"round-trips {old['round_trips']} -> {new['round_trips']}")
+
+    regressed = comparison[comparison['regressed'] != '']
+    if len(regressed) > 0:
+        print(f"Regressed stages: {', '.join(regressed['stage'])}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+# Bulk loading helpers that stream the ETL dataframes into PostgreSQL with COPY
+
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from sqlalchemy import inspect
+
+from instrument import stage, timed_stage, count_round_trips, with_stages # Stage timings of the run report
+
+# Number of dataframe rows rendered to CSV at a time while streaming a table
+COPY_CHUNK_ROWS = 10000
+
+# Tables loaded at the same time, each over its own pooled connection
+LOAD_WORKERS = 4
+
+# File-like object that hands COPY the dataframe as CSV text one slice at a time,
+# so the full frame is never materialized a second time as a string
+class DataFrameCSVStream:
+    def __init__(self, df, chunk_rows=COPY_CHUNK_ROWS):
+        self.df = df
+        self.chunk_rows = chunk_rows
+        self.position = 0
+        self.buffer = ''
+
+    def _render_next_chunk(self):
+        chunk = self.df.iloc[self.position:self.position + self.chunk_rows]
+        self.position += self.chunk_rows
+        return chunk.to_csv(header=False, index=False, na_rep='')
+
+    def read(self, size=-1):
+        while (size is None or size < 0 or len(self.buffer) < size) and self.position < len(self.df):
+            self.buffer += self._render_next_chunk()
+
+        if size is None or size < 0:
+            size = len(self.buffer)
+
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def readline(self):
+        while '\n' not in self.buffer and self.position < len(self.df):
+            self.buffer += self._render_next_chunk()
+
+        end = self.buffer.find('\n') + 1 or len(self.buffer)
+        line, self.buffer = self.buffer[:end], self.buffer[end:]
+        return line
+
+def build_copy_statement(engine, table_name, columns):
+    preparer = engine.dialect.identifier_preparer
+    column_list = ', '.join(preparer.quote(column) for column in columns)
+    return f"COPY {preparer.quote(table_name)} ({column_list}) FROM STDIN WITH (FORMAT csv, NULL '')"
+
+def report_load(result):
+    print(f"Loaded {result['rows']} rows into {result['table']} in {result['seconds']:.2f}s "
+          f"({result['rows_per_second']:.0f} rows/s)")
+
+def load_result(table_name, rows, seconds):
+    return {
+        'table': table_name,
+        'rows': rows,
+        'seconds': seconds,
+        'rows_per_second': rows / seconds if seconds > 0 else float('inf')
+    }
+
+# Runs COPY for one dataframe on an open cursor, leaving the transaction to the caller.
+# The rows stream to the server without waiting for replies, so the whole COPY is one round-trip.
+def copy_dataframe(cursor, engine, df, table_name, chunk_rows=COPY_CHUNK_ROWS):
+    cursor.copy_expert(build_copy_statement(engine, table_name, df.columns), DataFrameCSVStream(df, chunk_rows))
+    count_round_trips()
+
+def loaded_rows(results):
+    return sum(result['rows'] for result in results)
+
+# Streams one dataframe into its table inside a single transaction and reports the throughput. With replace, the
+# rows already in the table are deleted in the same transaction, so a failed load leaves them in place.
+def copy_table(engine, df, table_name, chunk_rows=COPY_CHUNK_ROWS, replace=False):
+    start = time.perf_counter()
+    with stage(f'copy {table_name}', rows_in=len(df)) as record:
+        connection = engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            try:
+                if replace:
+                    cursor.execute(f"DELETE FROM {engine.dialect.identifier_preparer.quote(table_name)}")
+                    count_round_trips()
+                copy_dataframe(cursor, engine, df, table_name, chunk_rows)
+            finally:
+                cursor.close()
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            count_round_trips()
+            connection.close()
+        record['rows_out'] = len(df)
+
+    return load_result(table_name, len(df), time.perf_counter() - start)
+
+# Parent tables of every table in the load, read from the foreign keys of the database schema.
+# References to tables outside the load are left out, since their rows are already in the database.
+def table_dependencies(engine, table_names):
+    inspector = inspect(engine)
+    return {
+        table_name: {foreign_key['referred_table'] for foreign_key in inspector.get_foreign_keys(table_name)
+                     if foreign_key['referred_table'] in table_names and foreign_key['referred_table'] != table_name}
+        for table_name in table_names
+    }
+
+# Loads the tables as soon as their parent tables are loaded, up to `workers` at a time, each one over its own
+# pooled connection and committed on its own. When a table fails, the tables that depend on it are skipped and
+# every other table still loads, so only the failed and skipped tables need to be loaded again.
+@timed_stage(rows_out=loaded_rows)
+def load_tables(engine, tables, chunk_rows=COPY_CHUNK_ROWS, workers=LOAD_WORKERS):
+    start = time.perf_counter()
+    frames = dict(tables)
+    pending = table_dependencies(engine, list(frames))
+    results, failed, skipped = {}, {}, []
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        running = {}
+        while pending or running:
+            for table_name, parents in list(pending.items()):
+                if parents & (failed.keys() | set(skipped)):
+                    skipped.append(table_name)
+                    del pending[table_name]
+                elif parents <= results.keys():
+                    running[with_stages(executor, copy_table, engine, frames[table_name], table_name, chunk_rows)] = table_name
+                    del pending[table_name]
+
+            if not running:
+                if not pending:
+                    break
+                raise ValueError(f"Foreign keys between {', '.join(pending)} form a cycle, no load order exists")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                table_name = running.pop(future)
+                try:
+                    results[table_name] = future.result()
+                except Exception as error:
+                    failed[table_name] = error
+                    print(f"Failed to load {table_name}: {error}")
+                else:
+                    report_load(results[table_name])
+
+    seconds = time.perf_counter() - start
+    print(f"Loaded {len(results)} tables in {seconds:.2f}s wall time "
+          f"({sum(result['seconds'] for result in results.values()):.2f}s summed over tables)")
+
+    if failed:
+        retry = list(failed) + skipped
+        raise RuntimeError(f"Failed to load {', '.join(failed)}"
+                           + (f" and skipped {', '.join(skipped)} which depend on them" if skipped else '')
+                           + f". The other tables are committed; load the rest with --only {' '.join(retry)}"
+                           ) from next(iter(failed.values()))
+
+    return [results[table_name] for table_name in frames]
+
+# Loads an iterable of batches, each a list of (table name, dataframe) pairs in FK order, over one connection
+# and in one transaction, so the caller can produce the batches lazily and never hold a whole table.
+# The reported time per table only counts its COPY statements, not the work that produced the batches. Every
+# COPY is a stage of the run report, named like those of load_tables. The (statement, parameters) pairs of
+# `before` run first in the same transaction, for example to delete the rows the batches replace.
+def load_table_batches(engine, batches, chunk_rows=COPY_CHUNK_ROWS, before=()):
+    totals = {}
+    # The batches are produced while loading, so the rows in are only known once every batch is loaded
+    with stage('load_table_batches') as record:
+        connection = engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            try:
+                for statement, parameters in before:
+                    cursor.execute(statement, parameters)
+                    count_round_trips()
+                for batch in batches:
+                    for table_name, df in batch:
+                        start = time.perf_counter()
+                        with stage(f'copy {table_name}', rows_in=len(df)) as copy_record:
+                            copy_dataframe(cursor, engine, df, table_name, chunk_rows)
+                            copy_record['rows_out'] = len(df)
+                        total = totals.setdefault(table_name, {'rows': 0, 'seconds': 0.0})
+                        total['rows'] += len(df)
+                        total['seconds'] += time.perf_counter() - start
+            finally:
+                cursor.close()
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            count_round_trips()
+            connection.close()
+        record['rows_in'] = record['rows_out'] = sum(total['rows'] for total in totals.values())
+
+    results = [load_result(table_name, total['rows'], total['seconds']) for table_name, total in totals.items()]
+    for result in results:
+        report_load(result)
+    return results
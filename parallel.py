@@ -0,0 +1,90 @@
+# Runs independent table builders in worker processes. The source frames are written once as Arrow IPC files
+# that every worker memory-maps, so the frames are never pickled and a worker only converts the columns its
+# builder reads. The built tables come back to the parent the same way.
+
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:  # Without pyarrow the builders run one after another
+    pa = None
+
+import instrument
+from instrument import RunReport, detach_report, timed_stage
+
+def write_arrow(df, path):
+    table = pa.Table.from_pandas(df)
+    with pa.OSFile(path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+# Memory-mapped reads share the file's pages with every other process reading it.
+# Missing strings come back from Arrow as None, so they are turned back into NaN as read_csv leaves them.
+def read_arrow(path, columns=None, memory_map=True):
+    source = pa.memory_map(path) if memory_map else pa.OSFile(path)
+    table = pa.ipc.open_file(source).read_all()
+    if columns is not None:
+        table = table.select(columns)
+
+    df = table.to_pandas()
+    for column in df.select_dtypes('object'):
+        df[column] = df[column].where(df[column].notna(), np.nan)
+    return df
+
+# Worker side: loads the inputs of one builder from the shared files, builds its table and writes it back.
+# With `report_start`, the parent has a run report, and the stages of the worker are returned for it. The builder
+# runs with the parent's copy-on-write option, which a worker that was not forked would not have.
+def run_builder(builder, inputs, output_path, report_start=None, copy_on_write=False):
+    report = RunReport().start(report_start) if report_start is not None else None
+    try:
+        frames = [read_arrow(path, columns) for path, columns in inputs]
+        with pd.option_context('mode.copy_on_write', copy_on_write):
+            write_arrow(builder(*frames), output_path)
+    finally:
+        if report is not None:
+            report.stop()
+    return output_path, [] if report is None else report.stages
+
+# Runs jobs of (table name, builder, [(source name, columns or None for all of them), ...]) on the source frames,
+# up to `workers` at a time. The tables are returned in job order whichever worker finishes first.
+@timed_stage
+def run_builders(jobs, sources, workers):
+    if pa is None or workers <= 1:
+        if workers > 1:
+            print('pyarrow is not installed, the tables are built one after another')
+        return [(table_name, builder(*[sources[source_name] for source_name, _ in inputs]))
+                for table_name, builder, inputs in jobs]
+
+    shared_dir = tempfile.mkdtemp(prefix='etl-transform-')
+    try:
+        paths = {}
+        for source_name, df in sources.items():
+            paths[source_name] = os.path.join(shared_dir, f'{source_name}.arrow')
+            write_arrow(df, paths[source_name])
+
+        report = instrument.active_report
+        report_start = report.start_counter if report is not None else None
+        with ProcessPoolExecutor(max_workers=workers, initializer=detach_report) as executor:
+            futures = [
+                (table_name, executor.submit(run_builder, builder,
+                                             [(paths[source_name], columns) for source_name, columns in inputs],
+                                             os.path.join(shared_dir, f'{table_name}.built.arrow'), report_start,
+                                             pd.get_option('mode.copy_on_write')))
+                for table_name, builder, inputs in jobs
+            ]
+            tables = []
+            for table_name, future in futures:
+                output_path, stages = future.result()
+                if report is not None:
+                    report.add_stages(stages, f'{table_name} worker')
+                # Read into memory rather than mapped, as the files are deleted below
+                tables.append((table_name, read_arrow(output_path, memory_map=False)))
+            return tables
+    finally:
+        shutil.rmtree(shared_dir)
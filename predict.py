@@ -0,0 +1,194 @@
+# Winner model on the pre-fight differentials of Fight_differentials: a logistic regression fitted with NumPy on
+# fights.winner_color, used to score every fight of upcoming.csv at once
+
+import argparse
+import json
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+from ETL import read_master, build_tables_cached, create_fight_differentials
+
+MODEL_PATH = 'winner_model.json'
+
+# Red minus blue differences, as create_fight_differentials computes them
+FEATURE_COLUMNS = ['lose_streak_diff', 'win_streak_diff', 'longest_win_streak_diff', 'wins_diff', 'losses_diff',
+                   'draws_diff', 'total_rounds_diff', 'total_title_bouts_diff', 'ko_diff', 'submission_diff',
+                   'height_cms_diff', 'reach_cms_diff', 'weight_lbs_diff', 'age_diff', 'sig_strikes_diff',
+                   'avg_submission_att_diff', 'avg_takedown_landed_diff']
+
+# Ridge penalty on the standardized coefficients, which keeps the Newton steps stable on collinear differences
+L2_PENALTY = 1.0
+
+# Tables read from the database once, by default the three the model needs
+def read_tables(engine, table_names=('fights', 'events', 'fight_differentials')):
+    with engine.connect() as conn:
+        return {table_name: pd.read_sql(text(f"SELECT * FROM {table_name}"), conn) for table_name in table_names}
+
+# Feature matrix, labels (1 when red won), event dates and fight_ids of every fight with a winner, sorted by date
+def training_data(tables):
+    tables = dict(tables)
+    event_dates = dict(zip(tables['events']['event_id'], tables['events']['event_date']))
+
+    fights = tables['fights'][['fight_id', 'event_id', 'winner_color']]
+    data = tables['fight_differentials'][['fight_id'] + FEATURE_COLUMNS].merge(fights, on='fight_id')
+    data = data[data['winner_color'].isin(['Red', 'Blue'])]
+    data = data.assign(event_date=pd.to_datetime(data['event_id'].map(event_dates))).sort_values(
+        ['event_date', 'fight_id'], kind='stable')
+
+    features = data[FEATURE_COLUMNS].to_numpy(dtype='float64', na_value=np.nan)
+    labels = (data['winner_color'] == 'Red').to_numpy(dtype='float64')
+    return features, labels, data['event_date'].to_numpy(), data['fight_id'].to_numpy()
+
+def sigmoid(z):
+    return 1 / (1 + np.exp(-z))
+
+# Standardized design matrix with a leading column of ones; missing values take the training mean
+def design_matrix(features, mean, scale):
+    features = np.where(np.isnan(features), mean, features)
+    return np.column_stack([np.ones(len(features)), (features - mean) / scale])
+
+# Fits the model by Newton's method. `start` is a previous model whose weights warm start the iterations.
+def fit(features, labels, l2=L2_PENALTY, start=None, max_iterations=50, tolerance=1e-8):
+    mean = np.nanmean(features, axis=0)
+    scale = np.nanstd(features, axis=0)
+    scale[~(scale > 0)] = 1
+    design = design_matrix(features, mean, scale)
+
+    weights = np.zeros(design.shape[1]) if start is None else np.array([start['intercept']] + start['coefficients'])
+    penalty = np.full(design.shape[1], l2)
+    penalty[0] = 0  # The intercept is not penalized
+
+    for _ in range(max_iterations):
+        probability = sigmoid(design @ weights)
+        gradient = design.T @ (probability - labels) + penalty * weights
+        hessian = (design * (probability * (1 - probability))[:, None]).T @ design + np.diag(penalty)
+        step = np.linalg.solve(hessian, gradient)
+        weights -= step
+        if np.abs(step).max() < tolerance:
+            break
+
+    return {
+        'features': FEATURE_COLUMNS,
+        'mean': mean.tolist(),
+        'scale': scale.tolist(),
+        'intercept': float(weights[0]),
+        'coefficients': weights[1:].tolist(),
+        'l2': l2,
+        'trained_fights': len(labels)
+    }
+
+# Probability that the red corner wins, for every row of the feature matrix in one matrix product
+def predict_proba(model, features):
+    design = design_matrix(features, np.array(model['mean']), np.array(model['scale']))
+    return sigmoid(design @ np.array([model['intercept']] + model['coefficients']))
+
+def log_loss(labels, probability):
+    probability = np.clip(probability, 1e-15, 1 - 1e-15)
+    return float(-np.mean(labels * np.log(probability) + (1 - labels) * np.log(1 - probability)))
+
+def save_model(model, path=MODEL_PATH):
+    with open(path, 'w') as model_file:
+        json.dump(model, model_file, indent=2)
+
+def load_model(path=MODEL_PATH):
+    with open(path) as model_file:
+        return json.load(model_file)
+
+# Red-win probability and predicted winner of every fight of a master-format card such as upcoming.csv
+def score_card(model, card):
+    features = create_fight_differentials(card)[model['features']].to_numpy(dtype='float64', na_value=np.nan)
+    probability = predict_proba(model, features)
+    return pd.DataFrame({
+        'date': card['Date'],
+        'red_fighter': card['RedFighter'],
+        'blue_fighter': card['BlueFighter'],
+        'red_win_probability': probability.round(4),
+        'predicted_winner': np.where(probability >= 0.5, 'Red', 'Blue')
+    })
+
+# Walk-forward folds `step_months` long from `start`, as (fold start, end of the training prefix, end of the fold).
+# The data is sorted by date, so each training set is a prefix of the arrays and nothing is reloaded.
+def walk_forward_folds(dates, start, step_months=12):
+    boundaries = list(pd.date_range(start, dates.max(), freq=f'{step_months}MS')) + [dates.max() + np.timedelta64(1, 'D')]
+    positions = np.searchsorted(dates, np.array(boundaries, dtype='datetime64[ns]'))
+    return [(fold_start, train_end, test_end) for fold_start, train_end, test_end in zip(boundaries, positions[:-1], positions[1:])
+            if train_end > 0 and test_end > train_end]
+
+# Red-win probability of every fight from a model trained only on the fights before its fold, NaN before `start`
+def out_of_sample_probabilities(features, labels, dates, start, step_months=12, l2=L2_PENALTY):
+    probability = np.full(len(labels), np.nan)
+    model = None
+    for _, train_end, test_end in walk_forward_folds(dates, start, step_months):
+        model = fit(features[:train_end], labels[:train_end], l2, start=model)
+        probability[train_end:test_end] = predict_proba(model, features[train_end:test_end])
+    return probability
+
+# Retrains on every fight before each fold and scores the fights of the fold
+def walk_forward(features, labels, dates, start, step_months=12, l2=L2_PENALTY):
+    probabilities = out_of_sample_probabilities(features, labels, dates, start, step_months, l2)
+
+    folds = []
+    for fold_start, train_end, test_end in walk_forward_folds(dates, start, step_months):
+        probability = probabilities[train_end:test_end]
+        test_labels = labels[train_end:test_end]
+        folds.append({
+            'fold_start': fold_start.date().isoformat(),
+            'train_fights': int(train_end),
+            'test_fights': int(test_end - train_end),
+            'accuracy': float(np.mean((probability >= 0.5) == test_labels)),
+            'log_loss': log_loss(test_labels, probability)
+        })
+    return pd.DataFrame(folds)
+
+def main():
+    parser = argparse.ArgumentParser(description='Train the winner model and score upcoming.csv')
+    parser.add_argument('command', choices=['train', 'score', 'walk-forward'], help='What to run')
+    parser.add_argument('--csv', default='ufc-master.csv', help='Master CSV whose (cached) tables are trained on')
+    parser.add_argument('--database-url', help='Train on the loaded tables of this database instead of --csv')
+    parser.add_argument('--upcoming', default='upcoming.csv', help='Card to score')
+    parser.add_argument('--model', default=MODEL_PATH, help='Where the fitted parameters are saved')
+    parser.add_argument('--output', help='Also write the scored card to this CSV file')
+    parser.add_argument('--l2', type=float, default=L2_PENALTY, help='Ridge penalty of the regression')
+    parser.add_argument('--start', default='2015-01-01', help='First walk-forward test fold')
+    parser.add_argument('--step-months', type=int, default=12, help='Length of every walk-forward test fold')
+    args = parser.parse_args()
+
+    if args.command == 'score':
+        model = load_model(args.model)
+        card = read_master(args.upcoming)
+        start = time.perf_counter()
+        scores = score_card(model, card)
+        seconds = time.perf_counter() - start
+        print(scores.to_string(index=False))
+        print(f"Scored {len(scores)} fights in {seconds * 1000:.2f} ms")
+        if args.output:
+            scores.to_csv(args.output, index=False)
+        return
+
+    tables = read_tables(create_engine(args.database_url)) if args.database_url else build_tables_cached(args.csv)[0]
+    features, labels, dates, _ = training_data(tables)
+
+    if args.command == 'train':
+        start = time.perf_counter()
+        model = fit(features, labels, args.l2)
+        seconds = time.perf_counter() - start
+        probability = predict_proba(model, features)
+        save_model(model, args.model)
+        print(f"Trained on {len(labels)} fights in {seconds * 1000:.1f} ms: accuracy "
+              f"{np.mean((probability >= 0.5) == labels):.3f}, log loss {log_loss(labels, probability):.4f}. "
+              f"Saved to {args.model}")
+    else:
+        start = time.perf_counter()
+        folds = walk_forward(features, labels, dates, args.start, args.step_months, args.l2)
+        seconds = time.perf_counter() - start
+        print(folds.to_string(index=False))
+        tested = folds['test_fights'].sum()
+        print(f"{len(folds)} folds, {tested} fights in {seconds:.2f}s: accuracy "
+              f"{(folds['accuracy'] * folds['test_fights']).sum() / tested:.3f}, "
+              f"log loss {(folds['log_loss'] * folds['test_fights']).sum() / tested:.4f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+# Glicko ratings of every fighter, computed in date order over Fights and stored in Fighter_ratings.
+# The ratings live in arrays indexed by fighter_id. Fights on the same date are independent of each other, so
+# each date is rated in one step of array operations instead of one fight at a time.
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+from ETL import DATABASE_URL
+from loader import copy_table, report_load
+
+INITIAL_RATING = 1500.0
+INITIAL_DEVIATION = 350.0
+
+# Variance added to the deviation for every day without a fight, so that a settled deviation of 50 is back to an
+# unrated fighter's 350 after five years out
+DEVIATION_GROWTH_PER_DAY = (INITIAL_DEVIATION ** 2 - 50.0 ** 2) / (5 * 365)
+
+Q = np.log(10) / 400
+
+# Score of the winner by finish method: a finish is a full win, a split decision barely more than a draw.
+# Missing methods count as a full win.
+FINISH_SCORES = {'KO/TKO': 1.0, 'SUB': 1.0, 'U-DEC': 0.9, 'M-DEC': 0.8, 'S-DEC': 0.7, 'DQ': 0.6}
+NO_CONTEST_FINISHES = ['Overturned']
+
+# Title bouts move the ratings this much more than other fights
+TITLE_BOUT_WEIGHT = 1.25
+
+RATING_COLUMNS = ['fight_id', 'fighter_id', 'rating_before', 'deviation_before', 'rating_after', 'deviation_after']
+
+# Rating, deviation and day of the last fight (-1 before the first one) of every fighter_id
+class RatingState:
+    def __init__(self, size=0):
+        self.rating = np.full(size, INITIAL_RATING)
+        self.deviation = np.full(size, INITIAL_DEVIATION)
+        self.last_day = np.full(size, -1, dtype=np.int64)
+
+    def grow(self, size):
+        if size > len(self.rating):
+            extra = size - len(self.rating)
+            self.rating = np.append(self.rating, np.full(extra, INITIAL_RATING))
+            self.deviation = np.append(self.deviation, np.full(extra, INITIAL_DEVIATION))
+            self.last_day = np.append(self.last_day, np.full(extra, -1, dtype=np.int64))
+
+    # State after the latest rated fight of every fighter, from its fighter_id, rating_after, deviation_after and
+    # event_date
+    @classmethod
+    def from_latest(cls, latest):
+        state = cls()
+        if len(latest) > 0:
+            fighter_ids = latest['fighter_id'].to_numpy(dtype='int64')
+            state.grow(fighter_ids.max() + 1)
+            state.rating[fighter_ids] = latest['rating_after'].to_numpy(dtype='float64')
+            state.deviation[fighter_ids] = latest['deviation_after'].to_numpy(dtype='float64')
+            state.last_day[fighter_ids] = to_days(latest['event_date'])
+        return state
+
+    # Deviation of the fighters on a day, grown by the time since their last fight
+    def deviation_on(self, fighter_ids, day):
+        idle_days = np.where(self.last_day[fighter_ids] >= 0, day - self.last_day[fighter_ids], 0)
+        return np.minimum(np.sqrt(self.deviation[fighter_ids] ** 2 + DEVIATION_GROWTH_PER_DAY * idle_days),
+                          INITIAL_DEVIATION)
+
+def to_days(dates):
+    return pd.to_datetime(pd.Series(dates)).to_numpy(dtype='datetime64[D]').astype(np.int64)
+
+# Glicko-1 update of one side of a batch of fights, each fight its own rating period. A weight of 0 (no contest)
+# leaves the rating and the deviation as they were.
+def glicko_update(rating, deviation, opponent_rating, opponent_deviation, score, weight):
+    g = 1 / np.sqrt(1 + 3 * Q ** 2 * opponent_deviation ** 2 / np.pi ** 2)
+    expected = 1 / (1 + 10 ** (-g * (rating - opponent_rating) / 400))
+    precision = 1 / deviation ** 2 + Q ** 2 * g ** 2 * expected * (1 - expected)
+
+    new_rating = rating + weight * Q / precision * g * (score - expected)
+    new_deviation = np.where(weight > 0, np.sqrt(1 / precision), deviation)
+    return new_rating, new_deviation
+
+# Step of every fight within its day. Fights of a day share step 0 unless a fighter has several of them, as in the
+# old one-night tournaments, where each repeat waits for the step after the fighter's previous fight.
+def rating_levels(day, red, blue):
+    level = np.zeros(len(day), dtype=np.int64)
+    corners = pd.DataFrame({'fight': np.tile(np.arange(len(day)), 2), 'day': np.tile(day, 2),
+                            'fighter': np.concatenate([red, blue])})
+    corners = corners[corners.duplicated(['day', 'fighter'], keep=False)].sort_values('fight', kind='stable')
+
+    fights = corners['fight'].to_numpy()
+    keys = [corners['day'].to_numpy(), corners['fighter'].to_numpy()]
+    while len(fights) > 0:
+        levels = pd.Series(level[fights])
+        required = levels.groupby(keys).shift(fill_value=-1).to_numpy() + 1
+        behind = required > levels.to_numpy()
+        if not behind.any():
+            break
+        np.maximum.at(level, fights[behind], required[behind])
+    return level
+
+# Rates fights in date order (then fight_id) starting from `state`, which is updated in place. The fights need
+# fight_id, event_date, red_fighter_id, blue_fighter_id, winner_color, finish_method and title_bout. Returns the
+# red then blue rating rows of every fight, in the order the fights were rated.
+def rate_fights(fights, state):
+    fights = fights.sort_values(['event_date', 'fight_id'], kind='stable')
+    day = to_days(fights['event_date'])
+    red = fights['red_fighter_id'].to_numpy(dtype='int64')
+    blue = fights['blue_fighter_id'].to_numpy(dtype='int64')
+    if len(fights) > 0:
+        state.grow(max(red.max(), blue.max()) + 1)
+
+    winner = fights['winner_color'].astype('object')
+    win_score = fights['finish_method'].astype('object').map(FINISH_SCORES).fillna(1.0).to_numpy(dtype='float64')
+    red_score = np.select([winner == 'Red', winner == 'Blue'], [win_score, 1 - win_score], 0.5)
+    weight = (np.where(fights['title_bout'].to_numpy(dtype=bool), TITLE_BOUT_WEIGHT, 1.0)
+              * ~fights['finish_method'].isin(NO_CONTEST_FINISHES).to_numpy())
+
+    # Before/after rating and deviation of the red (column 0) and blue (column 1) corner of every fight
+    rating_before, deviation_before = np.empty((len(fights), 2)), np.empty((len(fights), 2))
+    rating_after, deviation_after = np.empty((len(fights), 2)), np.empty((len(fights), 2))
+
+    level = rating_levels(day, red, blue)
+    order = np.lexsort((np.arange(len(fights)), level, day))
+    boundaries = np.flatnonzero((np.diff(day[order]) != 0) | (np.diff(level[order]) != 0)) + 1
+    for step in np.split(order, boundaries):
+        red_ids, blue_ids, step_day = red[step], blue[step], day[step]
+        red_rating, blue_rating = state.rating[red_ids], state.rating[blue_ids]
+        red_deviation, blue_deviation = state.deviation_on(red_ids, step_day), state.deviation_on(blue_ids, step_day)
+
+        new_red_rating, new_red_deviation = glicko_update(red_rating, red_deviation, blue_rating, blue_deviation,
+                                                          red_score[step], weight[step])
+        new_blue_rating, new_blue_deviation = glicko_update(blue_rating, blue_deviation, red_rating, red_deviation,
+                                                            1 - red_score[step], weight[step])
+
+        rating_before[step] = np.column_stack([red_rating, blue_rating])
+        deviation_before[step] = np.column_stack([red_deviation, blue_deviation])
+        rating_after[step] = np.column_stack([new_red_rating, new_blue_rating])
+        deviation_after[step] = np.column_stack([new_red_deviation, new_blue_deviation])
+
+        state.rating[red_ids], state.rating[blue_ids] = new_red_rating, new_blue_rating
+        state.deviation[red_ids], state.deviation[blue_ids] = new_red_deviation, new_blue_deviation
+        state.last_day[red_ids], state.last_day[blue_ids] = step_day, step_day
+
+    return pd.DataFrame({
+        'fight_id': np.repeat(fights['fight_id'].to_numpy(dtype='int64'), 2),
+        'fighter_id': np.column_stack([red, blue]).ravel(),
+        'rating_before': rating_before.ravel(),
+        'deviation_before': deviation_before.ravel(),
+        'rating_after': rating_after.ravel(),
+        'deviation_after': deviation_after.ravel()
+    })
+
+# Fights in the shape rate_fights takes, from the tables the ETL builds
+def fights_from_tables(tables):
+    tables = dict(tables)
+    event_dates = dict(zip(tables['events']['event_id'], tables['events']['event_date']))
+    fights = tables['fights'][['fight_id', 'event_id', 'red_fighter_id', 'blue_fighter_id', 'winner_color',
+                               'finish_method', 'title_bout']]
+    return fights.assign(event_date=fights['event_id'].map(event_dates))
+
+# Fights of the database without ratings yet, or every fight for a replay
+def fetch_unrated_fights(engine, replay=False):
+    unrated = "" if replay else "WHERE NOT EXISTS (SELECT 1 FROM fighter_ratings r WHERE r.fight_id = f.fight_id)"
+    with engine.connect() as conn:
+        return pd.read_sql(text(
+            "SELECT f.fight_id, e.event_date, f.red_fighter_id, f.blue_fighter_id, f.winner_color, f.finish_method, "
+            "f.title_bout "
+            "FROM fights f "
+            "JOIN events e ON e.event_id = f.event_id "
+            + unrated
+        ), conn)
+
+# Rating after the latest rated fight of every fighter
+def fetch_latest_ratings(engine):
+    with engine.connect() as conn:
+        return pd.read_sql(text(
+            "SELECT DISTINCT ON (r.fighter_id) r.fighter_id, r.rating_after, r.deviation_after, e.event_date "
+            "FROM fighter_ratings r "
+            "JOIN fights f ON f.fight_id = r.fight_id "
+            "JOIN events e ON e.event_id = f.event_id "
+            "ORDER BY r.fighter_id, e.event_date DESC, r.fight_id DESC"
+        ), conn)
+
+# Rates the fights loaded since the last run, continuing from the stored ratings. Fights dated before the latest
+# rated fight would change the ratings after them, and fights on its date are rated together with the fights
+# already rated that day, so then (or with full=True) the history is replayed. A replay deletes the old ratings in
+# the transaction that loads the new ones, so a failed load keeps them.
+def update_ratings(engine, full=False):
+    latest = fetch_latest_ratings(engine)
+    unrated = fetch_unrated_fights(engine)
+    if len(unrated) == 0 and not full:
+        print('Every fight is already rated')
+        return
+
+    replay = len(latest) > 0 and (
+        full or pd.to_datetime(unrated['event_date']).min() <= pd.to_datetime(latest['event_date']).max())
+    if replay:
+        print('Replaying the whole fight history')
+        latest, unrated = latest.iloc[0:0], fetch_unrated_fights(engine, replay=True)
+
+    start = time.perf_counter()
+    ratings = rate_fights(unrated, RatingState.from_latest(latest))
+    print(f"Rated {len(unrated)} fights in {time.perf_counter() - start:.3f}s")
+    report_load(copy_table(engine, ratings[RATING_COLUMNS], 'fighter_ratings', replace=replay))
+
+def main():
+    parser = argparse.ArgumentParser(description='Update the Glicko ratings in Fighter_ratings')
+    parser.add_argument('--database-url', default=DATABASE_URL, help='SQLAlchemy URL of the target database')
+    parser.add_argument('--full', action='store_true', help='Recompute every rating instead of only the new fights')
+    args = parser.parse_args()
+
+    update_ratings(create_engine(args.database_url), args.full)
+
+if __name__ == '__main__':
+    main()
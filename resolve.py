@@ -0,0 +1,351 @@
+# Fighter name resolution. Names are compared on a normalized key (no accents, case or punctuation, common
+# first-name nicknames folded), and only names that share a blocking key, built from the full phonetic skeleton of
+# the family name, are scored. Resolving a batch costs a bounded number of comparisons per name instead of one per
+# known name, and the comparisons are scored a batch of pairs at a time with NumPy.
+
+import argparse
+import re
+import time
+import unicodedata
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# Lowest similarity of two match keys that makes a candidate for the same fighter, and the lower one for keys that
+# are the same letters with some of them swapped (Ciryl/Cyril) and the same phonetic skeletons, as swaps cost a lot
+# of similarity. Only names with the same words (up to nicknames and word order) are merged automatically, the
+# other matches are kept as candidates for review.
+MATCH_THRESHOLD = 0.92
+SWAPPED_LETTERS_THRESHOLD = 0.8
+
+# A candidate also needs the family names to agree on their own: the same full phonetic skeleton and a similarity
+# of at least this, so Martins/Marin or Mann/Mccann never pair up however close the whole names are
+FAMILY_NAME_THRESHOLD = 0.8
+
+# Two names only match when the genders agree and the heights are within an inch, wherever both are known.
+# Relatives with near identical names (Erick and Erik Silva, Daniel and Danny Roberts) differ in height.
+HEIGHT_TOLERANCE_CMS = 2.54
+
+# Blocks with more names than this are dropped from the side that is searched, as common names (a Silva whose
+# first name starts with Jo) would otherwise make the pairs grow with the square of the names. Every name has two
+# blocks, so it is still compared through the other one.
+BLOCK_LIMIT = 100
+
+# Candidate pairs built and scored at a time, which bounds the memory of matching however many names there are
+PAIR_BATCH = 200000
+
+# Longest match key the bit-parallel scorer compares, the letters of one key fit in one uint64
+MAX_KEY_LENGTH = 63
+
+# Short first names folded into the name they stand for
+NICKNAMES = {
+    'alex': 'alexander', 'andy': 'andrew', 'ben': 'benjamin', 'bill': 'william', 'billy': 'william',
+    'bob': 'robert', 'bobby': 'robert', 'chris': 'christopher', 'dan': 'daniel', 'danny': 'daniel',
+    'ed': 'edward', 'eddie': 'edward', 'greg': 'gregory', 'jeff': 'jeffrey', 'jim': 'james', 'jimmy': 'james',
+    'joe': 'joseph', 'josh': 'joshua', 'matt': 'matthew', 'mike': 'michael', 'nick': 'nicholas', 'pat': 'patrick',
+    'phil': 'philip', 'phillip': 'philip', 'rick': 'richard', 'ricky': 'richard', 'rob': 'robert', 'sam': 'samuel',
+    'steve': 'steven', 'tim': 'timothy', 'tom': 'thomas', 'tommy': 'thomas', 'tony': 'anthony', 'will': 'william',
+    'zach': 'zachary', 'zak': 'zachary'
+}
+
+# Spellings of one sound across transliterations (Khabib/Habib, Zhang/Jang), replaced before the skeleton is taken
+TRANSLITERATIONS = [('dzh', 'j'), ('kh', 'h'), ('zh', 'j'), ('sch', 's'), ('sh', 's'), ('ch', 'c'), ('ph', 'f'),
+                    ('ck', 'k'), ('th', 't')]
+SOUND_CLASSES = str.maketrans('cqzvdbjx', 'kksftpgk')
+
+# Lowercase ASCII words of a name, the form two spellings must share to be the same name
+def name_key(name):
+    name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode('ascii').lower()
+    return ' '.join(re.sub(r'[^a-z]+', ' ', name).split())
+
+# Name key with the first name's nickname folded, the form names are scored and blocked on
+def match_key(key):
+    first, _, rest = key.partition(' ')
+    return f'{NICKNAMES.get(first, first)} {rest}' if rest else key
+
+# Consonant skeleton of one word: first letter, then the consonants by sound class with repeats collapsed.
+# First and family names repeat across fighters, so every word is worked out once.
+@lru_cache(maxsize=None)
+def phonetic_key(word):
+    for spelling, sound in TRANSLITERATIONS:
+        word = word.replace(spelling, sound)
+    word = word[0] + re.sub('[aeiouyhw]', '', word[1:])
+    return re.sub(r'(.)\1+', r'\1', word.translate(SOUND_CLASSES))
+
+# Blocks of a match key: the skeletons of the first and family name, and the first two letters of the first name
+# with the family skeleton, so a typo in the first name still leaves a shared block. Names without a family name
+# have no blocks, as they only ever match by their words.
+def blocking_keys(key):
+    words = key.split()
+    if len(words) < 2:
+        return []
+    family = phonetic_key(words[-1])
+    return [f'{phonetic_key(words[0])}|{family}', f'{words[0][:2]}|{family}']
+
+# Phonetic skeletons of every word of a match key, then its letters in sorted order
+def sound_key(key):
+    return ' '.join(phonetic_key(word) for word in key.split()) + '|' + ''.join(sorted(key))
+
+# Match key, its words in sorted order (the same for Zhang Weili and Weili Zhang), sound key, and the family name
+# with its skeleton (missing for one-word names) of one name key
+def key_parts(key):
+    match = match_key(key)
+    words = match.split()
+    family = words[-1] if len(words) > 1 else None
+    return match, ' '.join(sorted(words)), sound_key(match), family, phonetic_key(family) if family else None
+
+# Name keys and the parts they are matched on of a column of names, each distinct name normalized once
+def name_keys(names):
+    codes, uniques = pd.factorize(pd.Series(names, dtype='object'))
+    keys = [name_key(name) for name in uniques]
+    parts = list(zip(*[key_parts(key) for key in keys])) or [[]] * 5
+    columns = dict(zip(['key', 'match_key', 'sorted_key', 'sound_key', 'family', 'family_sound'], [keys] + parts))
+    return pd.DataFrame({column: np.array(list(values) + [None], dtype=object)[codes] for column, values in columns.items()})
+
+# One row per (block, position) of a column of match keys
+def block_table(match_keys):
+    return pd.DataFrame({'position': np.arange(len(match_keys)),
+                         'block': [blocking_keys(key) for key in match_keys]}).explode('block').dropna()
+
+# Blocks of the side that is searched without the blocks of more than `limit` names
+def capped_blocks(blocks, limit=BLOCK_LIMIT):
+    sizes = blocks['block'].map(blocks['block'].value_counts())
+    return blocks[sizes <= limit]
+
+# Keys as a uint8 matrix, one row per key padded with zero bytes, and the length of every key
+def encoded_keys(keys):
+    encoded = np.asarray(keys, dtype=object).astype(f'S{MAX_KEY_LENGTH}')
+    return encoded.view(np.uint8).reshape(len(encoded), MAX_KEY_LENGTH), np.char.str_len(encoded)
+
+# Similarity of two columns of keys, pair by pair: twice their longest common subsequence over their total length.
+# The subsequence of every pair is found at once with the bit-parallel algorithm of Hyyrö, one uint64 of match
+# bits per pair for each letter of the left keys.
+def similarity(left, right):
+    left, left_lengths = encoded_keys(left)
+    right, right_lengths = encoded_keys(right)
+    width = int(max(left_lengths.max(initial=0), right_lengths.max(initial=0)))
+    right = np.where(right[:, :width] == 0, 255, right[:, :width])  # Padding never matches
+
+    rows = np.full(len(left), np.iinfo(np.uint64).max, dtype=np.uint64)
+    bits = np.zeros((len(left), 8), dtype=np.uint8)
+    for letter in range(width):
+        matches = right == left[:, letter:letter + 1]
+        bits[:, :(width + 7) // 8] = np.packbits(matches, axis=1, bitorder='little')
+        u = rows & bits.view('<u8')[:, 0]
+        rows = (rows + u) | (rows - u)
+
+    masks = np.left_shift(np.uint64(1), right_lengths.astype(np.uint64)) - np.uint64(1)
+    common = np.bitwise_count(~rows & masks).astype('float64')
+    total = left_lengths + right_lengths
+    return np.divide(2 * common, total, out=np.ones(len(total)), where=total > 0)
+
+# Whether the gender and height evidence of the pairs of two frames allows them to be one fighter
+def attributes_agree(left, right, left_positions, right_positions):
+    gender_left = left['gender'].astype('object').fillna('').to_numpy()[left_positions]
+    gender_right = right['gender'].astype('object').fillna('').to_numpy()[right_positions]
+    height_left = left['height_cms'].to_numpy(dtype='float64')[left_positions]
+    height_right = right['height_cms'].to_numpy(dtype='float64')[right_positions]
+    same_gender = (gender_left == '') | (gender_right == '') | (gender_left == gender_right)
+    close_height = ~(np.abs(height_left - height_right) > HEIGHT_TOLERANCE_CMS)  # True when either height is NaN
+    return same_gender & close_height
+
+# Candidate pairs (left, right positions) from shared blocks, in batches of about PAIR_BATCH pairs. The right
+# blocks are sorted once, so the names of a left block are one range of them, and the batches split the left blocks
+# between positions, so a pair that shares two blocks is in one batch. With `ordered` (a frame matched against
+# itself) only pairs with the left position first are kept.
+def candidate_pairs(left_blocks, right_blocks, ordered=False):
+    codes, _ = pd.factorize(pd.concat([right_blocks['block'], left_blocks['block']], ignore_index=True))
+    right_codes, left_codes = codes[:len(right_blocks)], codes[len(right_blocks):]
+    right_order = np.argsort(right_codes, kind='stable')
+    right_codes, right_positions = right_codes[right_order], right_blocks['position'].to_numpy()[right_order]
+    span = int(right_positions.max(initial=0)) + 1  # A (left, right) pair packed into one int64 to drop repeats
+
+    left_order = np.argsort(left_blocks['position'].to_numpy(), kind='stable')
+    left_positions = left_blocks['position'].to_numpy()[left_order]
+    starts = np.searchsorted(right_codes, left_codes[left_order], side='left')
+    counts = np.searchsorted(right_codes, left_codes[left_order], side='right') - starts
+
+    if len(left_positions) == 0:
+        return
+    # A batch ends after the last block of a position, once the pairs so far reach the next multiple of PAIR_BATCH
+    ends = np.flatnonzero(np.append(left_positions[1:] != left_positions[:-1], True)) + 1
+    totals = np.cumsum(counts)[ends - 1]
+    cuts = ends[np.flatnonzero(np.diff(totals // PAIR_BATCH, prepend=0) > 0)]
+    for first, last in zip(np.concatenate([[0], cuts]), np.append(cuts, len(left_positions))):
+        batch_counts = counts[first:last]
+        offsets = np.arange(batch_counts.sum()) - np.repeat(np.cumsum(batch_counts) - batch_counts, batch_counts)
+        lefts = np.repeat(left_positions[first:last], batch_counts)
+        rights = right_positions[np.repeat(starts[first:last], batch_counts) + offsets]
+        if ordered:
+            lefts, rights = lefts[lefts < rights], rights[lefts < rights]
+        pairs = np.unique(lefts.astype('int64') * span + rights)
+        if len(pairs) > 0:
+            yield pairs // span, pairs % span
+
+# Scored pairs (left, right positions) of two frames of name keys with gender and height_cms. Pairs come only from
+# shared blocks, and are kept when their family names agree, they clear their threshold and their attributes agree.
+def matching_pairs(left, right, left_blocks, right_blocks, threshold=MATCH_THRESHOLD, ordered=False):
+    columns = ['match_key', 'sound_key', 'family', 'family_sound']
+    left_parts = {column: left[column].to_numpy(dtype=object) for column in columns}
+    right_parts = {column: right[column].to_numpy(dtype=object) for column in columns}
+
+    matched = []
+    for left_positions, right_positions in candidate_pairs(left_blocks, right_blocks, ordered):
+        family_left, family_right = left_parts['family'][left_positions], right_parts['family'][right_positions]
+        same_family = ((left_parts['family_sound'][left_positions] == right_parts['family_sound'][right_positions])
+                       & (family_left != None) & (family_right != None))  # noqa: E711, elementwise on object arrays
+        close = same_family & (family_left != family_right)
+        same_family[close] = similarity(family_left[close], family_right[close]) >= FAMILY_NAME_THRESHOLD
+        left_positions, right_positions = left_positions[same_family], right_positions[same_family]
+
+        score = similarity(left_parts['match_key'][left_positions], right_parts['match_key'][right_positions])
+        swapped = left_parts['sound_key'][left_positions] == right_parts['sound_key'][right_positions]
+        clears = (score >= threshold) | (swapped & (score >= SWAPPED_LETTERS_THRESHOLD))
+        clears &= attributes_agree(left, right, left_positions, right_positions)
+        matched.append(pd.DataFrame({'position_left': left_positions[clears], 'position_right': right_positions[clears],
+                                     'score': score[clears]}))
+
+    if not matched:
+        return pd.DataFrame({'position_left': np.array([], dtype='int64'), 'position_right': np.array([], dtype='int64'),
+                             'score': np.array([], dtype='float64')})
+    return pd.concat(matched, ignore_index=True)
+
+# Groups the names of one batch that are spellings of the same fighter, and finds the candidates for review among
+# the rest. Names with the same key always group, and names with the same words up to nicknames and word order
+# when their gender and height agree. Returns, for every name, the position of the first name of its group, so
+# callers list the spelling that should name the fighter first. The candidates are the best fuzzy match of a name
+# in an earlier group: its position, the position of the first name of that group and the score.
+def cluster_names(names, gender=None, height_cms=None, threshold=MATCH_THRESHOLD):
+    names = pd.Series(names, dtype='object').reset_index(drop=True)
+    batch = name_keys(names).assign(gender=gender_or_na(gender, len(names)),
+                                    height_cms=height_or_na(height_cms, len(names)))
+    # Names with the same key group, and a key joins the first name with its words when their attributes agree
+    positions = pd.Series(np.arange(len(batch)))
+    key_first = positions.groupby(batch['key'], sort=False).transform('first').fillna(positions).to_numpy(dtype='int64')
+    words_first = positions.groupby(batch['sorted_key'], sort=False).transform('first').fillna(positions)
+    words_first = words_first.to_numpy(dtype='int64')[key_first]
+    groups = np.where(attributes_agree(batch, batch, key_first, words_first), words_first, key_first)
+
+    blocks = capped_blocks(block_table(batch['match_key']))
+    pairs = matching_pairs(batch, batch, blocks, blocks, threshold, ordered=True)
+    group_left, group_right = groups[pairs['position_left']], groups[pairs['position_right']]
+    later_right = group_left < group_right
+    candidates = pd.DataFrame({
+        'position': np.where(later_right, pairs['position_right'], pairs['position_left']),
+        'candidate': np.where(later_right, group_left, group_right),
+        'score': pairs['score']
+    })[group_left != group_right]
+    candidates = candidates.sort_values(['position', 'score', 'candidate'], ascending=[True, False, True],
+                                        kind='stable').drop_duplicates('position').reset_index(drop=True)
+    return groups, candidates
+
+# Gender and height columns of a batch, all missing when the caller has no such evidence
+def gender_or_na(gender, size):
+    if gender is None:
+        return pd.Series(None, index=range(size), dtype='object')
+    return pd.Series(gender).astype('object').reset_index(drop=True)
+
+def height_or_na(height_cms, size):
+    if height_cms is None:
+        return np.full(size, np.nan)
+    return pd.Series(height_cms).to_numpy(dtype='float64', na_value=np.nan)
+
+# Index of every known spelling of the fighters in the database. `known` has alias_name, fighter_id and
+# fighter_name, plus the fighter's gender and height_cms when known.
+class FighterNameIndex:
+    def __init__(self, known):
+        entries = known.reset_index(drop=True)
+        entries = pd.concat([entries, name_keys(entries['alias_name'])], axis=1).drop_duplicates('key')
+        self.entries = entries.reset_index(drop=True)
+        self.key_positions = dict(zip(self.entries['key'], range(len(self.entries))))
+        first_sorted = self.entries.drop_duplicates('sorted_key')
+        self.sorted_positions = dict(zip(first_sorted['sorted_key'], first_sorted.index))
+        self.blocks = capped_blocks(block_table(self.entries['match_key']))
+
+    # Known fighter of every name: its fighter_id, fighter_name, the alias_name it matched and the match_score
+    # (1 for the same words), or missing values when no known fighter matches. Every distinct (name, gender,
+    # height) is resolved once, names with known words by dictionary and the rest by scoring their blocks.
+    def resolve(self, names, gender=None, height_cms=None, threshold=MATCH_THRESHOLD):
+        names = pd.Series(names, dtype='object')
+        queries = pd.concat([name_keys(names), pd.DataFrame({
+            'gender': gender_or_na(gender, len(names)), 'height_cms': height_or_na(height_cms, len(names))})], axis=1)
+        group = queries.groupby(['key', 'gender', 'height_cms'], dropna=False, sort=False).ngroup().to_numpy()
+        distinct = queries.drop_duplicates(['key', 'gender', 'height_cms']).reset_index(drop=True)
+
+        position = distinct['key'].map(self.key_positions).to_numpy(dtype='float64', na_value=np.nan, copy=True)
+        # Nicknames or another word order only match a known name whose attributes agree
+        by_words = distinct['sorted_key'].map(self.sorted_positions).to_numpy(dtype='float64', na_value=np.nan)
+        known_words = np.flatnonzero(np.isnan(position) & ~np.isnan(by_words))
+        agree = attributes_agree(distinct, self.entries, known_words, by_words[known_words].astype('int64'))
+        position[known_words[agree]] = by_words[known_words[agree]]
+        score = np.where(np.isnan(position), np.nan, 1.0)
+
+        unresolved = np.flatnonzero(np.isnan(position) & distinct['key'].notna().to_numpy())
+        if len(unresolved) > 0 and len(self.entries) > 0:
+            rest = distinct.iloc[unresolved].reset_index(drop=True)
+            pairs = matching_pairs(rest, self.entries, block_table(rest['match_key']), self.blocks, threshold)
+            best = pairs.sort_values(['position_left', 'score', 'position_right'], ascending=[True, False, True],
+                                     kind='stable').drop_duplicates('position_left')
+            position[unresolved[best['position_left']]] = best['position_right']
+            score[unresolved[best['position_left']]] = best['score']
+
+        found = ~np.isnan(position)
+        matched = self.entries.reindex(np.where(found, position, -1).astype('int64'))
+        result = pd.DataFrame({
+            'fighter_id': pd.array(matched['fighter_id'].where(found), dtype='Int64'),
+            'fighter_name': matched['fighter_name'].where(found).to_numpy(dtype=object),
+            'alias_name': matched['alias_name'].where(found).to_numpy(dtype=object),
+            'match_score': score
+        })
+        return result.iloc[group].set_axis(names.index)
+
+# Aliases of the tables the ETL builds with the gender and height of their fighters, as FighterNameIndex takes them
+def known_aliases(tables):
+    tables = dict(tables)
+    return tables['fighter_aliases'][['alias_name', 'fighter_id']].merge(
+        tables['fighters'][['fighter_id', 'fighter_name', 'gender', 'height_cms']], on='fighter_id')
+
+# Spellings kept apart from the fighter they may be, for review: each alias with its own fighter, the candidate
+# fighter and the score of the match
+def review_candidates(tables):
+    tables = dict(tables)
+    names = dict(zip(tables['fighters']['fighter_id'], tables['fighters']['fighter_name']))
+    candidates = tables['fighter_aliases'].dropna(subset=['candidate_fighter_id'])
+    return pd.DataFrame({
+        'alias_name': candidates['alias_name'],
+        'fighter_name': candidates['fighter_id'].map(names),
+        'candidate_name': candidates['candidate_fighter_id'].map(names),
+        'candidate_fighter_id': candidates['candidate_fighter_id'],
+        'candidate_score': candidates['candidate_score']
+    }).sort_values('candidate_name').reset_index(drop=True)
+
+def main():
+    from ETL import build_tables_cached
+
+    parser = argparse.ArgumentParser(description='Resolve fighter names against the fighters of the master CSV')
+    parser.add_argument('names', nargs='*', help='Names to resolve. Without names, lists the merged spellings and the candidates')
+    parser.add_argument('--csv', default='ufc-master.csv', help='Master CSV whose (cached) tables are resolved against')
+    parser.add_argument('--threshold', type=float, default=MATCH_THRESHOLD, help='Lowest similarity that matches')
+    args = parser.parse_args()
+
+    tables = build_tables_cached(args.csv)[0]
+    known = known_aliases(tables)
+    if not args.names:
+        merged = known[known['alias_name'] != known['fighter_name']].sort_values('fighter_name')
+        print(merged[['alias_name', 'fighter_name', 'fighter_id']].to_string(index=False))
+        print(f"{len(merged)} spellings merged into {merged['fighter_id'].nunique()} fighters")
+        candidates = review_candidates(tables)
+        print(candidates.to_string(index=False))
+        print(f"{len(candidates)} spellings kept as their own fighter with a candidate to review")
+        return
+
+    index = FighterNameIndex(known)
+    start = time.perf_counter()
+    resolved = index.resolve(pd.Series(args.names), threshold=args.threshold)
+    seconds = time.perf_counter() - start
+    print(resolved.assign(name=args.names)[['name', 'fighter_name', 'fighter_id', 'match_score']].to_string(index=False))
+    print(f"Resolved {len(args.names)} names in {seconds * 1000:.2f} ms")
+
+if __name__ == '__main__':
+    main()
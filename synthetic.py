@@ -0,0 +1,235 @@
+# Synthetic master files of any size with the columns of ufc-master.csv, to run the ETL at sizes the real file never
+# reaches. Every fighter keeps one name, division, stance and set of measurements and fights several times over a
+# stretch of events. Per-fighter statistics, odds, finishes and the like are drawn from rows of the real file, a
+# block of related columns at a time, so values and null rates follow it. The columns the master file derives from
+# others (the differences, BetterRank, round times and fight time) are computed from the drawn values.
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from ETL import CORNER_COLUMNS
+
+# First possible date of a synthetic event. The events are spread between it and the last date of the template,
+# several to a date once there are more events than days.
+FIRST_DATE = '1993-11-12'
+
+# Corners per fighter, about what the real file has (13k corners of 2.1k fighters)
+FIGHTS_PER_FIGHTER = 6
+
+# Opponents of a fighter are this many fighters of the division away on average, so careers overlap for a while
+CAREER_SPREAD = 3.0
+
+ROUND_SECONDS = 300
+
+DECISIONS = ['U-DEC', 'S-DEC', 'M-DEC']
+
+# Per-corner columns of the master file the ETL does not load, beside the ones of ETL.CORNER_COLUMNS
+MASTER_CORNER_COLUMNS = {
+    **CORNER_COLUMNS,
+    'total_rounds_fought': ('RedTotalRoundsFought', 'BlueTotalRoundsFought'),
+    'total_title_bouts': ('RedTotalTitleBouts', 'BlueTotalTitleBouts')
+}
+
+# Columns that describe the fighter rather than the fight, fixed for every fight of a synthetic fighter
+PROFILE_COLUMNS = ['height_cms', 'reach_cms', 'stance', 'weight_lbs']
+
+# Per-corner columns drawn together from one corner of the real file: the record, the averages and the ranks
+CORNER_BLOCK = [column for column, (red, blue) in MASTER_CORNER_COLUMNS.items()
+                if red != blue and column not in PROFILE_COLUMNS + ['fighter_name']]
+
+# Columns of the real file drawn together, each block from its own random row
+FIGHT_BLOCKS = [
+    ['WeightClass', 'Gender'],
+    ['TitleBout', 'NumberOfRounds'],
+    ['Winner'],
+    ['EmptyArena'],
+    ['Finish', 'FinishDetails'],
+    ['RedOdds', 'BlueOdds', 'RedExpectedValue', 'BlueExpectedValue', 'RedDecOdds', 'BlueDecOdds', 'RSubOdds',
+     'BSubOdds', 'RKOOdds', 'BKOOdds']
+]
+
+# Difference columns of the master file: Blue minus Red of a per-corner column, missing values counting as 0
+DIFFERENCE_COLUMNS = {
+    'LoseStreakDif': 'CurrentLoseStreak', 'WinStreakDif': 'CurrentWinStreak', 'LongestWinStreakDif': 'LongestWinStreak',
+    'WinDif': 'Wins', 'LossDif': 'Losses', 'TotalRoundDif': 'TotalRoundsFought', 'TotalTitleBoutDif': 'TotalTitleBouts',
+    'KODif': 'WinsByKO', 'SubDif': 'WinsBySubmission', 'HeightDif': 'HeightCms', 'ReachDif': 'ReachCms',
+    'AgeDif': 'Age', 'SigStrDif': 'AvgSigStrLanded', 'AvgSubAttDif': 'AvgSubAtt', 'AvgTDDif': 'AvgTDLanded'
+}
+
+# The template as read_csv leaves it, so the synthetic file is written with the same number formats
+def read_template(path):
+    return pd.read_csv(path)
+
+# The profile columns of every corner of the template, with the weight class of its fight
+def template_corners(template):
+    corners = pd.DataFrame({
+        column: pd.concat([template[MASTER_CORNER_COLUMNS[column][0]], template[MASTER_CORNER_COLUMNS[column][1]]],
+                          ignore_index=True)
+        for column in PROFILE_COLUMNS
+    })
+    corners['weight_class'] = pd.concat([template['WeightClass']] * 2, ignore_index=True)
+    return corners
+
+def draw_rows(df, count, rng):
+    return df.iloc[rng.integers(len(df), size=count)].reset_index(drop=True)
+
+# Events as (date, location, country) with the number of fights on each card, drawn from the card sizes of the
+# template until they hold `rows` fights. Dates are in descending order like the master file.
+def synthetic_events(template, rows, rng):
+    card_sizes = template.groupby(['Date', 'Location']).size().to_numpy()
+    sizes = rng.choice(card_sizes, int(rows / card_sizes.mean() * 1.2) + 2)
+    sizes = sizes[:np.searchsorted(np.cumsum(sizes), rows) + 1]
+    sizes[-1] -= sizes.sum() - rows
+
+    first_day = pd.Timestamp(FIRST_DATE).value // 86400 // 10 ** 9
+    last_day = pd.Timestamp(template['Date'].max()).value // 86400 // 10 ** 9
+    days = np.sort(rng.integers(first_day, last_day + 1, size=len(sizes)))[::-1]
+    events = draw_rows(template[['Location', 'Country']], len(sizes), rng)
+    events['Date'] = pd.to_datetime(days, unit='D').strftime('%Y-%m-%d')
+    return events, sizes
+
+# Fighter numbers of the red and blue corner of every fight. Each division has its own fighters, about one per
+# FIGHTS_PER_FIGHTER corners; a fight's fighters are drawn around the fighter whose turn it is in the division,
+# so every fighter fights a handful of times over neighbouring events and meets opponents of the same era.
+def pair_fighters(divisions, rng):
+    codes, uniques = pd.factorize(divisions)
+    fights = np.bincount(codes, minlength=len(uniques))
+    fighters = np.maximum(2, np.ceil(2 * fights / FIGHTS_PER_FIGHTER)).astype('int64')
+    offsets = np.cumsum(fighters) - fighters
+
+    turn = pd.Series(codes).groupby(codes).cumcount().to_numpy()
+    slot = turn / fights[codes] * fighters[codes]
+    size = fighters[codes]
+    red = np.clip(np.floor(slot + rng.normal(0, CAREER_SPREAD, len(codes))), 0, size - 1).astype('int64')
+    blue = np.clip(np.floor(slot + rng.normal(0, CAREER_SPREAD, len(codes))), 0, size - 1).astype('int64')
+    blue = np.where(blue == red, (red + 1) % size, blue)
+
+    division_of_fighter = np.repeat(np.arange(len(uniques)), fighters)
+    return offsets[codes] + red, offsets[codes] + blue, uniques[division_of_fighter]
+
+# Distinct names made of the first and last names of the template's fighters of the same gender. Repeats get a
+# middle name until every name is distinct.
+def synthetic_names(template, genders, rng):
+    fighters = pd.Series(index=range(len(genders)), dtype=object)
+    first_names = {}
+    for gender in pd.unique(genders):
+        fights = template[template['Gender'] == gender]
+        names = pd.concat([fights['RedFighter'], fights['BlueFighter']]).dropna().drop_duplicates().str.split(n=1)
+        names = names[names.str.len() == 2]
+        first = first_names[gender] = names.str[0].drop_duplicates().to_numpy(dtype=object)
+        last = names.str[1].drop_duplicates().to_numpy(dtype=object)
+        of_gender = np.flatnonzero(genders == gender)
+        fighters[of_gender] = first[rng.integers(len(first), size=len(of_gender))] + ' ' \
+            + last[rng.integers(len(last), size=len(of_gender))]
+
+    repeated = fighters.duplicated()
+    while repeated.any():
+        for position in np.flatnonzero(repeated):
+            first = first_names[genders[position]]
+            given, family = fighters[position].split(' ', 1)
+            fighters[position] = f'{given} {first[rng.integers(len(first))]} {family}'
+        repeated = fighters.duplicated()
+    return fighters.to_numpy(dtype=object)
+
+# Measurements and stance of every fighter, from a random corner of the template in the fighter's weight class
+def fighter_profiles(corners, weight_classes, rng):
+    corners = corners.sort_values('weight_class', kind='stable').reset_index(drop=True)
+    bounds = corners.groupby('weight_class', sort=False).size()
+    starts = np.cumsum(bounds.to_numpy()) - bounds.to_numpy()
+    position = pd.Index(bounds.index).get_indexer(weight_classes)
+    rows = starts[position] + np.floor(rng.random(len(weight_classes)) * bounds.to_numpy()[position]).astype('int64')
+    return corners.iloc[rows][PROFILE_COLUMNS].reset_index(drop=True)
+
+# Finish round, round time and total fight time of every fight. Decisions go the distance; other finishes end in a
+# round drawn from the template's finishes, at a time anywhere in it. Fights without a finish have neither, and
+# some with one miss them too, as often as in the template.
+def finish_times(template, finish, rounds, rng):
+    stoppages = template.loc[~template['Finish'].isin(DECISIONS) & template['FinishRound'].notna(), 'FinishRound']
+    finish_round = np.minimum(rng.choice(stoppages.to_numpy(dtype='int64'), len(finish)), rounds)
+    seconds = rng.integers(1, ROUND_SECONDS + 1, size=len(finish))
+
+    decision = finish.isin(DECISIONS).to_numpy()
+    finish_round = np.where(decision, rounds, finish_round)
+    seconds = np.where(decision, ROUND_SECONDS, seconds)
+
+    finished = template['Finish'].notna()
+    missing_rate = (template['FinishRound'].isna() & finished).sum() / max(finished.sum(), 1)
+    missing = finish.isna().to_numpy() | (rng.random(len(finish)) < missing_rate)
+
+    round_time = pd.Series(seconds // 60).astype(str) + ':' + pd.Series(seconds % 60).astype(str).str.zfill(2)
+    return pd.DataFrame({
+        'FinishRound': np.where(missing, np.nan, finish_round),
+        'FinishRoundTime': round_time.mask(missing),
+        'TotalFightTimeSecs': np.where(missing, np.nan, (finish_round - 1) * ROUND_SECONDS + seconds)
+    })
+
+# Red when only the red fighter is ranked or is ranked higher (a lower number) in the weight class, Blue the other
+# way round, neither otherwise
+def better_rank(red_rank, blue_rank):
+    red_better = red_rank.notna() & (blue_rank.isna() | (red_rank < blue_rank))
+    blue_better = blue_rank.notna() & (red_rank.isna() | (blue_rank < red_rank))
+    return np.select([red_better, blue_better], ['Red', 'Blue'], 'neither')
+
+# Master frame of `rows` fights with the columns of the template, in the template's column order
+def generate_master(template, rows, seed=0):
+    rng = np.random.default_rng(seed)
+
+    events, card_sizes = synthetic_events(template, rows, rng)
+    events = events.iloc[np.repeat(np.arange(len(events)), card_sizes)].reset_index(drop=True)
+    columns = {column: events[column] for column in events}
+    for block in FIGHT_BLOCKS:
+        columns.update(draw_rows(template[block], rows, rng).items())
+
+    # The turn order of a division runs from the oldest fight, so careers advance with the dates
+    oldest_first = np.arange(rows)[::-1]
+    divisions = pd.MultiIndex.from_arrays([columns['WeightClass'].to_numpy()[oldest_first],
+                                           columns['Gender'].to_numpy()[oldest_first]])
+    red, blue, fighter_divisions = pair_fighters(divisions, rng)
+    red, blue = red[::-1], blue[::-1]
+
+    names = synthetic_names(template, fighter_divisions.get_level_values(1).to_numpy(), rng)
+    profiles = fighter_profiles(template_corners(template), fighter_divisions.get_level_values(0), rng)
+
+    # Red corners are drawn from red corners of the template and blue from blue ones, since the favourite in red
+    # usually has the longer record and fewer missing averages
+    for corner, fighters in [(0, red), (1, blue)]:
+        columns.update(draw_rows(template[[MASTER_CORNER_COLUMNS[column][corner] for column in CORNER_BLOCK]],
+                                 rows, rng).items())
+        columns[MASTER_CORNER_COLUMNS['fighter_name'][corner]] = names[fighters]
+        for column in PROFILE_COLUMNS:
+            columns[MASTER_CORNER_COLUMNS[column][corner]] = profiles[column].iloc[fighters].reset_index(drop=True)
+
+    for difference, column in DIFFERENCE_COLUMNS.items():
+        values = columns[f'Blue{column}'].fillna(0) - columns[f'Red{column}'].fillna(0)
+        columns[difference] = values.round(2) if pd.api.types.is_float_dtype(values) else values
+    columns['BetterRank'] = better_rank(columns['RMatchWCRank'], columns['BMatchWCRank'])
+    columns.update(finish_times(template, columns['Finish'], columns['NumberOfRounds'].to_numpy(), rng).items())
+
+    # copy=False keeps every column as its own block rather than copying them all into consolidated blocks
+    return pd.DataFrame({column: columns[column] for column in template.columns}, copy=False)
+
+# Writes a synthetic master file of `rows` fights with the columns of the template at template_path
+def write_synthetic_master(template_path, rows, path, seed=0):
+    master = generate_master(read_template(template_path), rows, seed)
+    master.to_csv(path, index=False)
+    return master
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic master CSV with the schema of ufc-master.csv')
+    parser.add_argument('rows', type=int, help='Fights in the synthetic file')
+    parser.add_argument('--output', help='Path of the synthetic file (default synthetic-<rows>.csv)')
+    parser.add_argument('--template', default='ufc-master.csv', help='Master CSV whose columns and values are followed')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random draws; the same seed gives the same file')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    output = args.output or f'synthetic-{args.rows}.csv'
+    master = write_synthetic_master(args.template, args.rows, output, args.seed)
+    print(f"Wrote {len(master)} fights of {pd.concat([master['RedFighter'], master['BlueFighter']]).nunique()} "
+          f"fighters at {master['Date'].nunique()} dates to {output} in {time.perf_counter() - start:.1f}s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+# The strategies of the backtester on three fights over two dates, against results worked out by hand
+
+import numpy as np
+import pytest
+
+from backtest import run_strategy
+
+# Fights 0 and 1 on the first date, fight 2 on the second. Red wins fight 0 only.
+DATA = {
+    'fight_id': np.array([1, 2, 3]),
+    'red_probability': np.array([0.7, 0.4, 0.6]),
+    'red_won': np.array([True, False, False]),
+    'red_odds': np.array([-200.0, 150.0, 100.0]),
+    'blue_odds': np.array([200.0, -167.0, -125.0]),
+    'red_decimal': np.array([1.5, 2.5, 2.0]),
+    'blue_decimal': np.array([3.0, 1.6, 1.8]),
+    'date': np.array(['2024-01-06', '2024-01-06', '2024-01-13'], dtype='datetime64[D]'),
+    'date_starts': np.array([0, 2])
+}
+
+@pytest.mark.parametrize('strategy, parameters, expected', [
+    # Red wins at 1.5, blue wins at 1.6, red loses: 100 -> 101.1 -> 100.1
+    ('flat', {'min_probability': 0.5},
+     {'bets': 3, 'hit_rate': 2 / 3, 'staked': 3.0, 'profit': 0.1, 'max_drawdown': 1 / 101.1, 'final_bankroll': 100.1}),
+    # Kelly stakes 0.1 of the bankroll on fight 0 (edge 0.05 at 1.5) and 0.2 on fight 2 (edge 0.2 at 2.0): 100 -> 105 -> 84
+    ('kelly', {'fraction': 1.0, 'min_edge': 0.0},
+     {'bets': 2, 'hit_rate': 0.5, 'staked': 31.0, 'profit': -16.0, 'max_drawdown': 0.2, 'final_bankroll': 84.0}),
+    # Ten times those stakes: the 2.0 of fight 2 is scaled down to the whole bankroll, which is lost
+    ('kelly', {'fraction': 10.0, 'min_edge': 0.0},
+     {'bets': 2, 'hit_rate': 0.5, 'staked': 250.0, 'profit': -100.0, 'max_drawdown': 1.0, 'final_bankroll': 0.0}),
+    # Only fight 2 has an edge above 0.05, and it loses
+    ('ev_threshold', {'threshold': 0.05},
+     {'bets': 1, 'hit_rate': 0.0, 'staked': 1.0, 'profit': -1.0, 'max_drawdown': 0.01, 'final_bankroll': 99.0}),
+    # Red is the underdog of fights 1 and 2 with a probability of at least 0.4, and loses both
+    ('underdog', {'min_odds': 100, 'min_probability': 0.4},
+     {'bets': 2, 'hit_rate': 0.0, 'staked': 2.0, 'profit': -2.0, 'max_drawdown': 0.02, 'final_bankroll': 98.0})
+])
+def test_strategies_match_hand_computed_results(strategy, parameters, expected):
+    result = run_strategy(DATA, strategy, parameters)
+    assert result['bets'] == expected['bets']
+    for name in ['hit_rate', 'staked', 'profit', 'max_drawdown', 'final_bankroll']:
+        assert result[name] == pytest.approx(expected[name]), name
+    assert result['roi'] == pytest.approx(expected['profit'] / expected['staked'])
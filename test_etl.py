@@ -0,0 +1,54 @@
+# The vectorized helpers of ETL.py against the row-by-row helpers they replace, on the columns of ufc-master.csv
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import ETL
+from ETL import (STANCE_DTYPE, read_master, build_tables, time_parser, parse_round_times, clean_fighter_names,
+                 clean_fighter_name_column, canonical_fighter_names, name_cache, to_enum)
+
+MASTER_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ufc-master.csv')
+
+@pytest.fixture(scope='module')
+def master():
+    return read_master(MASTER_CSV)
+
+def test_parse_round_times_matches_time_parser(master):
+    times = master['FinishRoundTime'].astype('object')
+    expected = pd.Series([time_parser(time) for time in times], index=times.index, dtype='Int64')
+    pd.testing.assert_series_equal(parse_round_times(master['FinishRoundTime']), expected, check_names=False)
+
+def test_parse_round_times_of_stray_values():
+    times = pd.Series(['4:59', '0:07', np.nan, '12:30', 'soon'], dtype='string')
+    assert parse_round_times(times).tolist() == [299, 7, pd.NA, 750, pd.NA]
+
+def test_clean_fighter_name_column_matches_clean_fighter_names(master):
+    names = pd.concat([master['RedFighter'], master['BlueFighter'],
+                       pd.Series(['  conor   mcgregor ', 'JOSE\tALDO', np.nan])], ignore_index=True).astype('object')
+    expected = names.map(clean_fighter_names)
+    pd.testing.assert_series_equal(clean_fighter_name_column(names), expected)
+    pd.testing.assert_series_equal(canonical_fighter_names(names), expected)
+
+def test_to_enum_strips_labels():
+    stances = pd.Series(['Orthodox', 'Switch ', np.nan, 'Southpaw'], name='RedStance')
+    recoded = to_enum(stances, STANCE_DTYPE)
+    assert recoded.dtype == STANCE_DTYPE
+    assert recoded.astype('object').tolist() == ['Orthodox', 'Switch', np.nan, 'Southpaw']
+
+def test_to_enum_raises_on_an_unknown_label():
+    with pytest.raises(ValueError, match='RedStance has values outside its ENUM: Sideways'):
+        to_enum(pd.Series(['Orthodox', 'Sideways'], name='RedStance'), STANCE_DTYPE)
+
+def test_name_cache_lasts_one_run(master):
+    build_tables(master.head(50))
+    assert ETL.canonical_name_cache is None
+
+    with name_cache():
+        canonical_fighter_names(pd.Series(['  jon jones']))
+        with name_cache():
+            canonical_fighter_names(pd.Series(['amanda  nunes']))
+        assert ETL.canonical_name_cache == {'  jon jones': 'Jon Jones', 'amanda  nunes': 'Amanda Nunes'}
+    assert ETL.canonical_name_cache is None
@@ -0,0 +1,50 @@
+# The point-in-time index against a brute-force scan of the history rows of ufc-master.csv
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ETL import read_master, build_tables
+from history import FighterHistory
+
+MASTER_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ufc-master.csv')
+
+@pytest.fixture(scope='module')
+def history():
+    return FighterHistory(build_tables(read_master(MASTER_CSV)))
+
+# Random (fighter, date) queries: known fighters on dates around their fights, and an id no fighter has
+def random_queries(history, count, seed):
+    generator = np.random.default_rng(seed)
+    rows = history.rows.sample(count, replace=True, random_state=seed)
+    shifts = pd.to_timedelta(generator.choice([-400, -1, 0, 0, 1, 30], size=count), unit='D')
+    fighter_ids = rows['fighter_id'].to_numpy().copy()
+    fighter_ids[:5] = history.fighter_ids.max() + 1
+    return fighter_ids, (rows['event_date'] + shifts).to_numpy()
+
+# Row positions of a fighter's fights before the date (on or before it with inclusive), in index order
+def scanned_positions(history, fighter_id, date, inclusive):
+    dates = history.rows['event_date']
+    before = dates <= date if inclusive else dates < date
+    return np.flatnonzero((history.rows['fighter_id'] == fighter_id) & before)
+
+@pytest.mark.parametrize('inclusive', [False, True])
+def test_as_of_matches_a_scan(history, inclusive):
+    fighter_ids, dates = random_queries(history, 2000, seed=1)
+    positions = history.positions(fighter_ids, dates, inclusive)
+    for fighter_id, date, position in zip(fighter_ids, dates, positions):
+        scanned = scanned_positions(history, fighter_id, date, inclusive)
+        assert position == (scanned[-1] if len(scanned) else -1)
+        assert history.position(int(fighter_id), date, inclusive) == position
+
+@pytest.mark.parametrize('inclusive', [False, True])
+def test_last_n_matches_a_scan(history, inclusive):
+    fighter_ids, dates = random_queries(history, 200, seed=2)
+    batch = history.last_n_batch(fighter_ids, dates, 3, inclusive)
+    for query, (fighter_id, date) in enumerate(zip(fighter_ids, dates)):
+        expected = history.rows.iloc[scanned_positions(history, fighter_id, date, inclusive)[-3:]]
+        actual = batch[batch['query'] == query].drop(columns=['query'])
+        pd.testing.assert_frame_equal(actual.reset_index(drop=True), expected.reset_index(drop=True))
+        pd.testing.assert_frame_equal(history.last_n(int(fighter_id), date, 3, inclusive), expected)
@@ -0,0 +1,38 @@
+# Incremental ratings from the stored latest ratings against a replay of the whole history of ufc-master.csv
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ETL import read_master, build_tables
+from ratings import RatingState, fights_from_tables, rate_fights
+
+MASTER_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ufc-master.csv')
+
+@pytest.fixture(scope='module')
+def fights():
+    return fights_from_tables(build_tables(read_master(MASTER_CSV)))
+
+# Rating after the latest rated fight of every fighter, as fetch_latest_ratings reads it from Fighter_ratings
+def latest_ratings(ratings, fights):
+    ratings = ratings.merge(fights[['fight_id', 'event_date']], on='fight_id')
+    ratings = ratings.sort_values(['fighter_id', 'event_date', 'fight_id'], ascending=[True, False, False])
+    return ratings.drop_duplicates('fighter_id')[['fighter_id', 'rating_after', 'deviation_after', 'event_date']]
+
+def by_fight(ratings):
+    return ratings.sort_values(['fight_id', 'fighter_id']).reset_index(drop=True)
+
+def test_incremental_ratings_match_a_replay(fights):
+    expected = rate_fights(fights, RatingState())
+
+    # Rated in three runs, each one continuing from the latest ratings the runs before it stored
+    dates = sorted(fights['event_date'].unique())
+    run = np.searchsorted([dates[-40], dates[-5]], fights['event_date'], side='right')
+    stored = rate_fights(fights[run == 0], RatingState())
+    for later_run in [1, 2]:
+        state = RatingState.from_latest(latest_ratings(stored, fights))
+        stored = pd.concat([stored, rate_fights(fights[run == later_run], state)])
+
+    pd.testing.assert_frame_equal(by_fight(stored), by_fight(expected))
@@ -0,0 +1,93 @@
+# Fighter name resolution without a database: the bit-parallel similarity against a plain LCS, the relatives that
+# must stay apart and the spellings that must merge, and the batches of candidate pairs.
+
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import resolve
+from resolve import MAX_KEY_LENGTH, FighterNameIndex, candidate_pairs, cluster_names, similarity
+
+# Length of the longest common subsequence of two strings, by dynamic programming
+def lcs_length(left, right):
+    row = [0] * (len(right) + 1)
+    for letter in left:
+        previous = 0
+        for column, other in enumerate(right, 1):
+            previous, row[column] = row[column], previous + 1 if letter == other else max(row[column], row[column - 1])
+    return row[-1]
+
+def lcs_ratio(left, right):
+    total = len(left) + len(right)
+    return 2 * lcs_length(left, right) / total if total else 1.0
+
+def random_keys(generator, count, max_length):
+    return [''.join(generator.choice('abcde ') for _ in range(generator.randint(0, max_length))) for _ in range(count)]
+
+def test_similarity_matches_lcs():
+    generator = random.Random(7)
+    left, right = random_keys(generator, 500, 20), random_keys(generator, 500, 20)
+    expected = [lcs_ratio(a, b) for a, b in zip(left, right)]
+    np.testing.assert_allclose(similarity(left, right), expected)
+
+def long_keys(generator, count):
+    return [''.join(generator.choice('ab') for _ in range(generator.randint(MAX_KEY_LENGTH - 3, MAX_KEY_LENGTH)))
+            for _ in range(count)]
+
+def test_similarity_at_the_longest_key():
+    generator = random.Random(11)
+    left, right = long_keys(generator, 200), long_keys(generator, 200)
+    expected = [lcs_ratio(a, b) for a, b in zip(left, right)]
+    np.testing.assert_allclose(similarity(left, right), expected)
+    assert similarity([left[0]], [left[0]])[0] == 1.0
+
+def test_relatives_stay_apart():
+    groups, _ = cluster_names(['Daniel Roberts', 'Danny Roberts'], ['MALE', 'MALE'], [180.34, 172.72])
+    assert groups[0] != groups[1]
+
+    known = pd.DataFrame({'alias_name': ['Daniel Roberts'], 'fighter_id': [1], 'fighter_name': ['Daniel Roberts'],
+                          'gender': ['MALE'], 'height_cms': [180.34]})
+    resolved = FighterNameIndex(known).resolve(pd.Series(['Danny Roberts']), ['MALE'], [172.72])
+    assert resolved['fighter_id'].isna().all()
+
+def test_nicknames_and_word_order_merge():
+    groups, _ = cluster_names(['Zhang Weili', 'Weili Zhang', 'Danny Roberts', 'Daniel Roberts'],
+                              ['FEMALE', 'FEMALE', 'MALE', 'MALE'], [162.56, 162.56, 180.34, None])
+    assert list(groups) == [0, 0, 2, 2]
+
+    known = pd.DataFrame({'alias_name': ['Zhang Weili'], 'fighter_id': [5], 'fighter_name': ['Zhang Weili'],
+                          'gender': ['FEMALE'], 'height_cms': [162.56]})
+    resolved = FighterNameIndex(known).resolve(pd.Series(['Weili Zhang']), ['FEMALE'], [162.56])
+    assert resolved['fighter_id'].tolist() == [5]
+    assert resolved['match_score'].tolist() == [1.0]
+
+def random_blocks(generator, names, block_names):
+    rows = [(position, f'b{generator.randrange(block_names)}') for position in range(names) for _ in range(2)]
+    return pd.DataFrame(rows, columns=['position', 'block'])
+
+# Every pair of positions that share a block, once
+def shared_block_pairs(left_blocks, right_blocks, ordered):
+    joined = left_blocks.merge(right_blocks, on='block', suffixes=('_left', '_right'))
+    pairs = set(zip(joined['position_left'], joined['position_right']))
+    return {(left, right) for left, right in pairs if not ordered or left < right}
+
+@pytest.mark.parametrize('pair_batch', [1, 3, 17, 1000])
+@pytest.mark.parametrize('ordered', [False, True])
+def test_candidate_pairs_across_batches(monkeypatch, pair_batch, ordered):
+    monkeypatch.setattr(resolve, 'PAIR_BATCH', pair_batch)
+    generator = random.Random(pair_batch)
+    left_blocks = random_blocks(generator, 60, 15)
+    right_blocks = left_blocks if ordered else random_blocks(generator, 80, 15)
+
+    batches = [list(zip(lefts, rights)) for lefts, rights in candidate_pairs(left_blocks, right_blocks, ordered)]
+    pairs = [pair for batch in batches for pair in batch]
+    assert len(pairs) == len(set(pairs))
+    assert set(pairs) == shared_block_pairs(left_blocks, right_blocks, ordered)
+    if pair_batch < len(pairs):
+        assert len(batches) > 1
+
+def test_candidate_pairs_without_blocks():
+    empty = pd.DataFrame({'position': np.array([], dtype='int64'), 'block': np.array([], dtype=object)})
+    assert list(candidate_pairs(empty, empty, ordered=True)) == []